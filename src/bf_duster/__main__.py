@@ -1,13 +1,8 @@
-import logging
 from argparse import ArgumentParser
 from decimal import Decimal
 
-from bf_duster.repo import BitfinexRepo
-from bf_duster.rest_client import RestClient
-from bf_duster.settings import Settings
-from bf_duster.steps import process_all
-
-logging.basicConfig(level=logging.WARNING)
+# Only lightweight modules are imported at module level so that `bf-duster --help` does not pay for pydantic,
+# requests and the rest of the package. Everything else is imported in main() once the arguments are parsed.
 
 
 def main():
@@ -17,12 +12,115 @@ def main():
         type=Decimal, default=Decimal('10'),
         help='Do not convert a wallet into BTC if value in USD is greater than this value.'
     )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        '--record',
+        metavar='CASSETTE',
+        help='Record every Bitfinex request and response into this cassette file.'
+    )
+    cassette_group.add_argument(
+        '--replay',
+        metavar='CASSETTE',
+        help='Serve Bitfinex responses from this cassette file instead of the network.'
+    )
+    parser.add_argument(
+        '--replay-latency-scale',
+        type=float, default=0.0,
+        help='Replay recorded latencies multiplied by this factor. 0 replays as fast as possible.'
+    )
+    parser.add_argument(
+        '--ws-wallets',
+        action='store_true',
+        help='Keep wallets up to date from an authenticated websocket stream instead of polling them over REST. '
+             'Needs the ws extra (websocket-client).'
+    )
+    parser.add_argument(
+        '--output',
+        choices=['text', 'jsonl'], default='text',
+        help='Print results as human readable text or as one JSON record per line.'
+    )
+    parser.add_argument(
+        '--plan-cache',
+        metavar='PATH',
+        help='Reuse the plans of wallets that did not change since the previous sweep and save them to this file.'
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='DIR',
+        help='Profile the sweep and write per-phase profiles to this directory.'
+    )
+    parser.add_argument(
+        '--profile-allocations',
+        action='store_true',
+        help='Also trace memory allocations while profiling and write an allocation summary. Skews the timings.'
+    )
     args = parser.parse_args()
+    if args.ws_wallets and args.replay:
+        parser.error('--ws-wallets can not be used with --replay')
+    if args.profile_allocations and not args.profile:
+        parser.error('--profile-allocations requires --profile')
+
+    if args.replay:
+        from bf_duster.cassette import Cassette, ReplayRestClient
+        c = ReplayRestClient(Cassette.load(args.replay), args.replay_latency_scale)
+    else:
+        from bf_duster.errors import SettingsException
+        from bf_duster.settings import load_settings
+
+        try:
+            s = load_settings()
+        except SettingsException as e:
+            parser.exit(1, f"{e}\n")
+
+        if args.record:
+            from bf_duster.cassette import RecordingRestClient
+            c = RecordingRestClient('https://api.bitfinex.com/', s.api_key, s.api_secret)
+        else:
+            from bf_duster.rest_client import RestClient
+            c = RestClient('https://api.bitfinex.com/', s.api_key, s.api_secret)
+
+    from bf_duster.logs import setup_queue_logging
+    from bf_duster.output import BackgroundResultWriter, JsonLinesResultWriter, TextResultWriter
+    from bf_duster.repo import BitfinexRepo
+    from bf_duster.steps import process_all
+
+    # from here on every exit path, including parser.exit, goes through the finally block below
+    log_listener = setup_queue_logging()
+    writer = BackgroundResultWriter(JsonLinesResultWriter() if args.output == 'jsonl' else TextResultWriter())
+    plan_cache = None
+    wallet_stream = None
+    try:
+        if args.plan_cache:
+            from bf_duster.plan_cache import PlanCache
+            plan_cache = PlanCache.load(args.plan_cache)
+
+        if args.ws_wallets:
+            from bf_duster.errors import RepoException
+            from bf_duster.wallet_stream import WalletStream
+
+            stream = WalletStream(s.api_key, s.api_secret)
+            try:
+                stream.start()
+            except RepoException as e:
+                parser.exit(1, f"{e}\n")
+            wallet_stream = stream
 
-    s = Settings()
-    c = RestClient('https://api.bitfinex.com/', s.api_key, s.api_secret)
-    r = BitfinexRepo(c)
-    process_all(r, args.max_value_usd)
+        r = BitfinexRepo(c, wallet_stream.store if wallet_stream else None)
+        if args.profile:
+            from bf_duster.profiling import profile_sweep
+            with profile_sweep(args.profile, args.profile_allocations):
+                process_all(r, args.max_value_usd, writer, plan_cache)
+        else:
+            process_all(r, args.max_value_usd, writer, plan_cache)
+    finally:
+        if wallet_stream is not None:
+            wallet_stream.close()
+        writer.close()
+        log_listener.stop()
+        if args.record:
+            c.cassette.save(args.record)
+        if plan_cache is not None:
+            plan_cache.save(args.plan_cache)
 
 
 if __name__ == '__main__':
@@ -6,3 +6,13 @@ class RepoException(Exception):
 class InvalidSymbolException(Exception):
     """Exception for invalid symbols."""
     pass
+
+
+class SettingsException(Exception):
+    """Exception for missing or invalid settings."""
+    pass
+
+
+class CassetteException(Exception):
+    """Exception for requests that can not be served from a recorded cassette."""
+    pass
@@ -0,0 +1,21 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+def setup_queue_logging(level: int = logging.WARNING) -> QueueListener:
+    """
+    Route all log records through a queue to a stream handler running on a background thread so slow log output
+    never stalls the sweep. The returned listener must be stopped to flush the remaining records.
+    """
+    q = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(q)]
+    root.setLevel(level)
+
+    listener = QueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+    return listener
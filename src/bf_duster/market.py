@@ -53,7 +53,9 @@ class MarketIndex:
             return pair.last_price
         pair = self._quote.get(base_currency, {}).get(quote_currency, None)
         if pair:
-            return 1 / pair.last_price
+            if pair.last_price:
+                return 1 / pair.last_price
+            return
 
         if try_through_currency:
             try_through_currency = try_through_currency.lower()
@@ -1,6 +1,6 @@
 from decimal import Decimal
 
-from bf_duster.models import TradingPair, Ticker, Wallet
+from bf_duster.models import TradingPair, Ticker, Wallet, Trade
 from bf_duster.symbol_parsers import parse_pair, parse_ticker_symbol
 
 
@@ -11,7 +11,7 @@ def decode_wallet(wallet_data) -> Wallet:
     return Wallet(
         type=wallet_data[0],
         currency=wallet_data[1],
-        balance_available=Decimal(wallet_data[4]),
+        balance_available=Decimal(str(wallet_data[4])),
     )
 
 
@@ -44,3 +44,46 @@ def decode_ticker(d: list) -> Ticker:
         quote=quote,
         last_price=Decimal(str(d[7])),
     )
+
+
+def decode_submitted_order_ids(d: list) -> list[int]:
+    """
+    Decode the ids of the orders created by an order submit notification returned by the Bitfinex API.
+    """
+    orders = d[4] or []
+    return [o[0] for o in orders]
+
+
+def decode_order_status(d: list) -> tuple[int, str, Decimal | None]:
+    """
+    Decode the id, status and average execution price of an order returned by the Bitfinex API.
+    """
+    avg_price = d[17]
+    return d[0], d[13], Decimal(str(avg_price)) if avg_price else None
+
+
+def decode_trade(d: list) -> Trade:
+    """
+    Decode a trade returned by the Bitfinex API.
+    """
+    return Trade(
+        order_id=d[3],
+        amount=Decimal(str(d[4])),
+        price=Decimal(str(d[5])),
+        fee=Decimal(str(d[9])),
+        fee_currency=d[10],
+    )
+
+
+def decode_stream_wallet(wallet_data) -> Wallet | None:
+    """
+    Decode a wallet from a websocket wallet snapshot or update. Returns None while Bitfinex has not calculated the
+    available balance, which it only sends in reply to a calc request.
+    """
+    if wallet_data[4] is None:
+        return None
+    return Wallet(
+        type=wallet_data[0],
+        currency=wallet_data[1],
+        balance_available=Decimal(str(wallet_data[4])),
+    )
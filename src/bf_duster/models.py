@@ -43,9 +43,43 @@ class FundsTransferTransaction(BaseModel):
     message: str = None
 
 
+class OrderFill(BaseModel):
+    order_id: int
+    status: str  # Ex: EXECUTED @ 27000.0(0.001), CANCELED
+    fill_price: Decimal = None
+    fee: Decimal = None  # negative when paid, positive for a rebate, as reported by Bitfinex
+    fee_currency: str = None
+
+
+class Trade(BaseModel):
+    order_id: int
+    amount: Decimal
+    price: Decimal
+    fee: Decimal
+    fee_currency: str
+
+
 class CreateOrderTransaction(BaseModel):
     type: str
     trading_symbol: str
     amount: Decimal
     success: bool = False
     message: str = None
+    order_id: int = None
+    order_status: str = None
+    fill_price: Decimal = None
+    fee: Decimal = None  # negative when paid, positive for a rebate, as reported by Bitfinex
+    fee_currency: str = None
+
+
+class WalletEvaluation(BaseModel):
+    currency: str
+    decision: str  # skip, direct or route
+    routes: list[str] = []  # intermediate currencies the wallet can be routed into
+    usd_price: Decimal = None  # value of one unit in usd
+    pair_prices: dict[str, Decimal] = {}  # last prices of the pairs the decision depends on
+    pairs: dict[str, str | None] = {}  # pair used for each currency looked at, None if there was no pair
+    pair_minimums: dict[str, Decimal] = {}  # minimum order sizes of those pairs
+    margin: Decimal = None  # relative distance to the nearest decision boundary
+    order_symbol: str = None  # trading symbol of a direct sell order, which does not depend on any price
+    order_amount: Decimal = None  # amount of that sell order
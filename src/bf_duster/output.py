@@ -1,5 +1,16 @@
+import json
+import logging
+import queue
+import sys
+import threading
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from typing import TextIO
+
 from bf_duster.models import FundsTransferTransaction, CreateOrderTransaction
 
+_logger = logging.getLogger(__name__)
+
 
 def format_funds_transfer_transaction(t: FundsTransferTransaction) -> str:
     result = 'success' if t.success else 'failed'
@@ -19,4 +30,152 @@ def format_create_order_transaction(t: CreateOrderTransaction) -> str:
     Amount:     {t.amount:.9f}
     Side:       {side}
     Result:     {result}
+    Order ID:   {t.order_id}
+    Status:     {t.order_status}
+    Fill price: {t.fill_price}
+    Fee:        {t.fee} {t.fee_currency or ''}
     Message:    {t.message} """
+
+
+def _to_record(kind: str, t: FundsTransferTransaction | CreateOrderTransaction) -> dict:
+    """
+    Convert a transaction into a JSON serializable record. Decimals are kept as strings so no precision is lost.
+    """
+    record = {'kind': kind}
+    for k, v in t.dict().items():
+        record[k] = str(v) if isinstance(v, Decimal) else v
+    return record
+
+
+def format_funds_transfer_record(t: FundsTransferTransaction) -> str:
+    return json.dumps(_to_record('transfer', t), separators=(',', ':'))
+
+
+def format_create_order_record(t: CreateOrderTransaction) -> str:
+    record = _to_record('order', t)
+    record['side'] = 'buy' if t.amount > 0 else 'sell'
+    return json.dumps(record, separators=(',', ':'))
+
+
+class ResultWriter(ABC):
+    """
+    Destination for the results of a sweep.
+    """
+
+    @abstractmethod
+    def write_transfer(self, t: FundsTransferTransaction):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_order(self, t: CreateOrderTransaction):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class TextResultWriter(ResultWriter):
+    """
+    Write human readable results, by default to standard output.
+    """
+
+    def __init__(self, stream: TextIO = None):
+        self._stream = stream
+
+    def write_transfer(self, t: FundsTransferTransaction):
+        print(format_funds_transfer_transaction(t), file=self._stream or sys.stdout)
+
+    def write_order(self, t: CreateOrderTransaction):
+        print(format_create_order_transaction(t), file=self._stream or sys.stdout)
+
+    def flush(self):
+        (self._stream or sys.stdout).flush()
+
+
+class JsonLinesResultWriter(ResultWriter):
+    """
+    Write one JSON record per result. Records are buffered and written in batches of buffer_size or on flush.
+    """
+
+    def __init__(self, stream: TextIO = None, buffer_size: int = 64):
+        self._stream = stream
+        self._buffer_size = buffer_size
+        self._lines = []
+
+    def _append(self, line: str):
+        self._lines.append(line)
+        if len(self._lines) >= self._buffer_size:
+            self.flush()
+
+    def write_transfer(self, t: FundsTransferTransaction):
+        self._append(format_funds_transfer_record(t))
+
+    def write_order(self, t: CreateOrderTransaction):
+        self._append(format_create_order_record(t))
+
+    def flush(self):
+        stream = self._stream or sys.stdout
+        if self._lines:
+            stream.write('\n'.join(self._lines) + '\n')
+            self._lines = []
+        stream.flush()
+
+
+class BackgroundResultWriter(ResultWriter):
+    """
+    Hand results to another writer on a background thread so a slow terminal or pipe never stalls the sweep. The
+    wrapped writer is flushed whenever the queue runs empty. Transactions are copied before they are queued.
+
+    If the wrapped writer fails, for example with a broken pipe, the error is kept, later results are dropped and the
+    error is logged together with the number of dropped results when the writer is closed.
+    """
+
+    _STOP = object()
+
+    def __init__(self, writer: ResultWriter):
+        self._writer = writer
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                if self._error is None:
+                    self._call(self._writer.close)
+                return
+            if self._error is not None:
+                self._dropped += 1
+                continue
+            write, t = item
+            if self._call(write, t) and self._queue.empty():
+                self._call(self._writer.flush)
+
+    def _call(self, f, *args) -> bool:
+        try:
+            f(*args)
+            return True
+        except Exception as e:
+            self._error = e
+            return False
+
+    def write_transfer(self, t: FundsTransferTransaction):
+        self._queue.put((self._writer.write_transfer, t.copy()))
+
+    def write_order(self, t: CreateOrderTransaction):
+        self._queue.put((self._writer.write_order, t.copy()))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if self._error is not None:
+            _logger.error(
+                "Writing results failed, %d later results were dropped: %r", self._dropped, self._error
+            )
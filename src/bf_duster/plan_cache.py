@@ -0,0 +1,123 @@
+import json
+import logging
+from decimal import Decimal
+from functools import lru_cache
+
+from bf_duster.market import MarketIndex
+from bf_duster.models import Wallet, WalletEvaluation
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_PRICE_BAND = Decimal('0.01')
+
+_VERSION = 4
+
+
+def wallet_key(w: Wallet, max_value_usd: Decimal, target_currency: str, intermediate_currencies: list[str]) -> str:
+    """
+    Build the cache key of a wallet evaluation. Any change to the balance or the planning parameters is a miss.
+    """
+    parameters = _parameters_key(max_value_usd, target_currency, tuple(intermediate_currencies))
+    return f"{w.type}|{w.currency}|{w.balance_available.normalize()}|{parameters}"
+
+
+@lru_cache(maxsize=16)
+def _parameters_key(max_value_usd: Decimal, target_currency: str, intermediate_currencies: tuple[str, ...]) -> str:
+    return f"{max_value_usd.normalize()}|{target_currency}|{','.join(intermediate_currencies)}"
+
+
+def _within(then: Decimal | None, now: Decimal | None, tolerance: Decimal) -> bool:
+    """
+    Check if a price moved by at most the relative tolerance.
+    """
+    if then is None or now is None or then == 0:
+        return then == now
+    return abs(now - then) / abs(then) <= tolerance
+
+
+def _decode_entry(entry: dict) -> dict:
+    """
+    Turn the decimal strings of a stored entry back into Decimals.
+    """
+    for field in ('usd_price', 'margin', 'order_amount'):
+        if entry[field] is not None:
+            entry[field] = Decimal(entry[field])
+    for field in ('pair_prices', 'pair_minimums'):
+        entry[field] = {k: Decimal(v) for k, v in entry[field].items()}
+    return entry
+
+
+class PlanCache:
+    """
+    Wallet evaluations persisted across sweeps. An evaluation is reused while every price it depends on stayed within
+    the price band and moved less than half of the wallet's distance to the nearest decision boundary, and while the
+    wallet would still trade on the same pairs with the same minimum order sizes, so a cached decision is never one
+    that fresh market data would change. Only the entries used by a sweep are saved.
+
+    Entries are checked in their stored form and only turned into evaluations on a hit, without validating them
+    again, so reusing a plan costs little more than looking up the market data it depends on. A direct sell order is
+    sized from the balance alone, so it is kept in the entry and reused as is; buy orders and pool estimates depend on
+    the price and are computed again.
+    """
+
+    def __init__(self, entries: dict[str, dict] = None, price_band: Decimal = DEFAULT_PRICE_BAND):
+        self._entries = entries or {}
+        self._used = {}
+        self._price_band = price_band
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str, price_band: Decimal = DEFAULT_PRICE_BAND) -> 'PlanCache':
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] != _VERSION:
+                raise ValueError(f"unsupported version {data['version']}")
+            entries = {key: _decode_entry(entry) for key, entry in data['entries'].items()}
+        except FileNotFoundError:
+            entries = {}
+        except (ValueError, KeyError, TypeError, ArithmeticError) as e:
+            _logger.warning("Ignoring unreadable plan cache %s: %s", path, e)
+            entries = {}
+        return cls(entries, price_band)
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': _VERSION, 'entries': self._used}, f, separators=(',', ':'), default=str)
+
+    def get(self, key: str, trading_pair_index: MarketIndex) -> WalletEvaluation | None:
+        entry = self._entries.get(key)
+        if entry is None or not self._is_valid(entry, trading_pair_index):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = entry
+        return WalletEvaluation.construct(**entry)
+
+    def put(self, key: str, evaluation: WalletEvaluation):
+        entry = evaluation.dict()
+        self._entries[key] = entry
+        self._used[key] = entry
+
+    def _is_valid(self, entry: dict, trading_pair_index: MarketIndex) -> bool:
+        tolerance = self._price_band
+        if entry['margin'] is not None:
+            tolerance = min(tolerance, entry['margin'] / 2)
+
+        usd_price = trading_pair_index.get_value_of(entry['currency'], 'usd', 'btc')
+        if not _within(entry['usd_price'], usd_price, tolerance):
+            return False
+        for symbol, then in entry['pair_prices'].items():
+            pair = trading_pair_index.get_pair_by_symbol(symbol)
+            if pair is None or not _within(then, pair.last_price, tolerance):
+                return False
+
+        # a new, removed or replaced pair or a changed minimum order size can change any decision
+        for currency, symbol in entry['pairs'].items():
+            usable_pairs = trading_pair_index.find_pairs(entry['currency'], currency)
+            if (usable_pairs[0].symbol if usable_pairs else None) != symbol:
+                return False
+            if usable_pairs and usable_pairs[0].min_order_size != entry['pair_minimums'][symbol]:
+                return False
+        return True
@@ -0,0 +1,161 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Phases are attributed from the profile itself so no code has to be instrumented. Each phase lists the functions
+# that enter it as (path suffix, function names). Only self time is attributed: a phase function and everything it
+# calls belong to its phase until another phase function is entered, so phases never overlap however the sweep nests
+# its stages.
+_PHASES = {
+    'network': [
+        ('requests/api.py', {'get', 'post'}),
+        ('bf_duster/cassette.py', {'_replay'}),
+    ],
+    'confirmation_wait': [
+        ('bf_duster/steps.py', {'_completed_batch'}),
+    ],
+    'decode': [
+        ('requests/models.py', {'json'}),
+        ('bf_duster/model_decoders.py', None),
+    ],
+    'planning': [
+        ('bf_duster/market.py', {'build_market_index'}),
+        ('bf_duster/steps.py', {'_iter_consolidation_orders'}),
+    ],
+}
+
+_TOP_ALLOCATIONS = 25
+
+
+def _phase_functions(stats: pstats.Stats, rules: list[tuple[str, set[str] | None]]) -> list[tuple]:
+    """
+    Return the profile entries matching the rules of a phase.
+    """
+    result = []
+    for func in stats.stats:
+        filename, _, name = func
+        filename = filename.replace(os.sep, '/')
+        for suffix, names in rules:
+            if filename.endswith(suffix) and (names is None or name in names):
+                result.append(func)
+                break
+    return result
+
+
+def _phase_shares(stats: pstats.Stats, entries: dict[tuple, str]) -> dict[tuple, dict[str, float]]:
+    """
+    Work out which phases the self time of every profiled function belongs to. Phase functions belong to their own
+    phase; any other function inherits the phases of its callers, weighted by the time spent in it from each caller.
+    cProfile keeps a single level of callers, so a function shared by several phases is split by those weights.
+    """
+    shares = {}
+
+    def share(func: tuple, visiting: set) -> dict[str, float]:
+        if func in shares:
+            return shares[func]
+        if func in entries:
+            shares[func] = {entries[func]: 1.0}
+            return shares[func]
+        if func in visiting:
+            # recursive calls are attributed through the outermost call
+            return {}
+
+        visiting.add(func)
+        callers = stats.stats[func][4]
+        weights = {c: edge[3] for c, edge in callers.items() if c in stats.stats}
+        if not any(weights.values()):
+            weights = {c: edge[0] for c, edge in callers.items() if c in stats.stats}
+        total = sum(weights.values())
+        result = {}
+        for caller, weight in weights.items():
+            for phase, fraction in share(caller, visiting).items():
+                result[phase] = result.get(phase, 0.0) + fraction * weight / total
+        visiting.discard(func)
+        shares[func] = result
+        return result
+
+    for func in stats.stats:
+        share(func, set())
+    return shares
+
+
+def _write_phases(profile: cProfile.Profile, total: float, output_dir: str):
+    """
+    Write the time spent in each phase to phases.json and the functions of each phase to phase-<name>.txt.
+    """
+    stats = pstats.Stats(profile)
+    functions = {phase: _phase_functions(stats, rules) for phase, rules in _PHASES.items()}
+    shares = _phase_shares(stats, {f: phase for phase, funcs in functions.items() for f in funcs})
+
+    seconds = dict.fromkeys(_PHASES, 0.0)
+    for func, phases in shares.items():
+        for phase, fraction in phases.items():
+            seconds[phase] += stats.stats[func][2] * fraction
+
+    summary = {'total_seconds': round(total, 6), 'phases': {}}
+    for phase in _PHASES:
+        calls = sum(stats.stats[f][1] for f in functions[phase])
+        summary['phases'][phase] = {'seconds': round(seconds[phase], 6), 'calls': calls}
+
+        with open(os.path.join(output_dir, f'phase-{phase}.txt'), 'w', encoding='utf-8') as f:
+            phase_stats = pstats.Stats(profile, stream=f)
+            phase_stats.sort_stats(pstats.SortKey.CUMULATIVE)
+            for func in functions[phase]:
+                phase_stats.print_callees(re.escape(pstats.func_std_string(func)))
+    attributed = sum(seconds.values())
+    summary['phases']['other'] = {'seconds': round(max(total - attributed, 0.0), 6), 'calls': None}
+
+    with open(os.path.join(output_dir, 'phases.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+
+def _write_allocations(snapshot: tracemalloc.Snapshot, peak: int, output_dir: str):
+    """
+    Write the peak traced memory and the lines that allocated the most memory to allocations.txt.
+    """
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+    with open(os.path.join(output_dir, 'allocations.txt'), 'w', encoding='utf-8') as f:
+        f.write(f"Peak traced memory: {peak / 1024:.1f} KiB\n")
+        f.write(f"Top {_TOP_ALLOCATIONS} allocating lines still alive at the end of the sweep:\n")
+        for s in snapshot.statistics('lineno')[:_TOP_ALLOCATIONS]:
+            f.write(f"{s}\n")
+
+
+@contextmanager
+def profile_sweep(output_dir: str, trace_allocations: bool = False):
+    """
+    Profile the wrapped code with cProfile and write the results to output_dir: sweep.prof (pstats dump of the whole
+    sweep) and phases.json and phase-<name>.txt (time spent waiting on the network, waiting for order confirmations,
+    decoding and planning). With trace_allocations the sweep also runs under tracemalloc and allocations.txt lists
+    the peak memory and top allocations; tracing slows every allocation down so it skews the timings.
+
+    Only the calling thread is profiled; time spent on background threads shows up as confirmation_wait.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    profile = cProfile.Profile()
+    if trace_allocations:
+        tracemalloc.start()
+    started = time.perf_counter()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        total = time.perf_counter() - started
+        if trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _write_allocations(snapshot, peak, output_dir)
+
+        profile.dump_stats(os.path.join(output_dir, 'sweep.prof'))
+        _write_phases(profile, total, output_dir)
@@ -1,17 +1,25 @@
 import logging
 from abc import ABC, abstractmethod
 from decimal import Decimal
-from typing import Any
+from typing import Any, Iterator
 
 from requests import Response, RequestException
 
 from bf_duster.errors import RepoException
-from bf_duster.model_decoders import decode_wallet, decode_pair, decode_ticker
-from bf_duster.models import Wallet, TradingPair, Ticker
+from bf_duster.model_decoders import (
+    decode_wallet, decode_pair, decode_ticker, decode_submitted_order_ids, decode_order_status, decode_trade
+)
+from bf_duster.models import Wallet, TradingPair, Ticker, OrderFill, Trade
 from bf_duster.rest_client import RestClient
+from bf_duster.symbol_parsers import parse_ticker_symbol
+from bf_duster.wallet_stream import WalletStore
 
 _logger = logging.getLogger(__name__)
 
+# maximum number of trades Bitfinex returns from a single trade history request
+_TRADES_LIMIT = 2500
+_WALLET_SYNC_TIMEOUT_SECONDS = 5
+
 
 class IRepo(ABC):
     """
@@ -25,6 +33,13 @@ class IRepo(ABC):
         """
         raise NotImplementedError
 
+    def iter_wallets(self) -> Iterator[Wallet]:
+        """
+        Iterate over all wallets for the current user. This default reads them all with get_wallets; implementations
+        can override it to decode each wallet only when it is pulled.
+        """
+        yield from self.get_wallets()
+
     @abstractmethod
     def get_trading_pairs(self) -> list[TradingPair]:
         """
@@ -59,13 +74,38 @@ class IRepo(ABC):
             order_type: str,
             trading_symbol: str,
             amount: Decimal,
-    ):
+    ) -> int | None:
+        """
+        Create an order to buy or sell a certain amount of a trading symbol and return the id of the created order.
         """
-        Create an order to buy or sell a certain amount of a trading symbol.
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_order_fills(self, order_ids: list[int]) -> list[OrderFill]:
+        """
+        Get the fill status, average fill price and fees of the specified orders. Orders that are still active are
+        not returned.
         """
         raise NotImplementedError
 
 
+def _build_order_fill(order_data: list, trades: list[Trade]) -> OrderFill:
+    """
+    Build an order fill from a closed order and the trades that executed it. The fee keeps the Bitfinex sign: negative
+    for fees paid and positive for maker rebates.
+    """
+    order_id, status, fill_price = decode_order_status(order_data)
+    fill = OrderFill(order_id=order_id, status=status, fill_price=fill_price)
+    if trades:
+        fill.fee = sum((t.fee for t in trades), Decimal(0))
+        fill.fee_currency = trades[0].fee_currency
+        if fill.fill_price is None:
+            executed = sum((abs(t.amount) for t in trades), Decimal(0))
+            if executed:
+                fill.fill_price = sum((abs(t.amount) * t.price for t in trades), Decimal(0)) / executed
+    return fill
+
+
 def _handle_response(resp: Response):
     """
     Handle a JSON HTTP response.
@@ -77,11 +117,34 @@ def _handle_response(resp: Response):
 
 class BitfinexRepo(IRepo):
     """
-    Repository implementation that provides data from Bitfinex.
+    Repository implementation that provides data from Bitfinex. When a wallet store is given, wallets are read from
+    it instead of being requested over REST as long as the stream keeps it up to date.
     """
 
-    def __init__(self, client: RestClient):
+    def __init__(self, client: RestClient, wallet_store: WalletStore = None):
         self._client = client
+        self._wallet_store = wallet_store
+        # wallets changed by earlier writes with their update counts before the write, and the same for orders
+        self._expected_updates: dict[tuple[str, str], int] = {}
+        self._expected_orders: dict[int, dict[tuple[str, str], int]] = {}
+
+    def _stored_wallets(self) -> list[Wallet] | None:
+        """
+        Read the wallets from the wallet store once it reflects every earlier transfer and order. Returns None when
+        the stream stopped or did not catch up in time, so the caller requests the wallets over REST instead.
+        """
+        store = self._wallet_store
+        synced = store.wait_for_sync(self._expected_updates, self._expected_orders, _WALLET_SYNC_TIMEOUT_SECONDS)
+        self._expected_updates = {}
+        self._expected_orders = {}
+        if synced:
+            return store.wallets()
+        if store.connected:
+            _logger.warning("Wallet stream did not catch up with earlier writes, requesting wallets over REST")
+        else:
+            _logger.warning("Wallet stream stopped, requesting wallets over REST from now on")
+            self._wallet_store = None
+        return None
 
     def _request_securely(self, path: str, params: dict = None, headers: dict = None) -> Any:
         """
@@ -102,8 +165,17 @@ class BitfinexRepo(IRepo):
             raise RepoException("Error while requesting from Bitfinex") from e
 
     def get_wallets(self) -> list[Wallet]:
+        return list(self.iter_wallets())
+
+    def iter_wallets(self) -> Iterator[Wallet]:
+        if self._wallet_store is not None:
+            wallets = self._stored_wallets()
+            if wallets is not None:
+                yield from wallets
+                return
         wallets = self._request_securely("v2/auth/r/wallets")
-        return [decode_wallet(w) for w in wallets]
+        for w in wallets:
+            yield decode_wallet(w)
 
     def get_trading_pairs(self) -> list[TradingPair]:
         pairs = self._request_public_data("v2/conf/pub:info:pair")
@@ -126,6 +198,11 @@ class BitfinexRepo(IRepo):
             currency_to: str,
             amount: Decimal
     ):
+        counts = {}
+        if self._wallet_store is not None:
+            counts = self._wallet_store.update_counts([
+                (wallet_from.lower(), currency_from.lower()), (wallet_to.lower(), currency_to.lower()),
+            ])
         self._request_securely("v2/auth/w/transfer", params={
             "from": wallet_from,
             "to": wallet_to,
@@ -133,15 +210,47 @@ class BitfinexRepo(IRepo):
             "currency_to": currency_to,
             "amount": str(amount)
         })
+        self._expected_updates.update(counts)
 
     def create_order(
             self,
             order_type: str,
             trading_symbol: str,
             amount: Decimal,
-    ):
-        self._request_securely("v2/auth/w/order/submit", params={
+    ) -> int | None:
+        counts = None
+        if self._wallet_store is not None:
+            wallet_type = 'exchange' if order_type.startswith('EXCHANGE') else 'margin'
+            counts = self._wallet_store.update_counts(
+                [(wallet_type, c.lower()) for c in parse_ticker_symbol(trading_symbol)]
+            )
+        resp = self._request_securely("v2/auth/w/order/submit", params={
             "type": order_type,
             "symbol": trading_symbol,
             "amount": str(amount)
         })
+        order_ids = decode_submitted_order_ids(resp)
+        if counts is not None:
+            for order_id in order_ids:
+                self._expected_orders[order_id] = counts
+        return order_ids[0] if order_ids else None
+
+    def get_order_fills(self, order_ids: list[int]) -> list[OrderFill]:
+        if not order_ids:
+            return []
+
+        # one request for the status of the whole batch and one for the trades that filled it
+        orders = self._request_securely("v2/auth/r/orders/hist", params={"id": order_ids})
+        wanted = set(order_ids)
+        orders = [o for o in orders if o[0] in wanted]
+        if not orders:
+            return []
+
+        start = min(o[4] for o in orders)
+        trades = self._request_securely("v2/auth/r/trades/hist", params={"start": start, "limit": _TRADES_LIMIT})
+        trades_by_order = {}
+        for t in trades:
+            trade = decode_trade(t)
+            trades_by_order.setdefault(trade.order_id, []).append(trade)
+
+        return [_build_order_fill(o, trades_by_order.get(o[0], [])) for o in orders]
@@ -1,17 +1,36 @@
 import hashlib
 import hmac
 import json
+import threading
 import time
 from urllib.parse import urljoin
 
 import requests
 
+# a request that lost the race to another thread's later nonce is signed again this many times in total
+_NONCE_ATTEMPTS = 3
 
-def _nonce() -> str:
+_nonce_lock = threading.Lock()
+_last_nonce = 0
+
+
+def next_nonce() -> str:
+    """
+    Generates a nonce that is strictly greater than every nonce generated before in this process. Bitfinex rejects a
+    nonce that is not greater than the last one it has seen for an API key, so signed REST requests and the websocket
+    authentication all take their nonces from here.
+    """
+    global _last_nonce
+    with _nonce_lock:
+        _last_nonce = max(int(round(time.time() * 10000)), _last_nonce + 1)
+        return str(_last_nonce)
+
+
+def _is_nonce_rejection(resp: requests.Response) -> bool:
     """
-    Generates a nonce
+    Check if Bitfinex rejected a signed request because its nonce was not greater than the last one it has seen
     """
-    return str(int(round(time.time() * 10000)))
+    return resp.status_code != 200 and 'nonce: small' in resp.text
 
 
 class RestClient:
@@ -42,14 +61,19 @@ class RestClient:
         """
         Sends a secure request to the Bitfinex API
         """
-        nonce = _nonce()
         body = params or {}
         headers = headers or {}
         headers.setdefault("content-type", "application/json")
         body_json = json.dumps(body)
-        headers = self._secure_headers(path, nonce, body_json, headers)
         url = urljoin(self._base_url, path)
-        return requests.post(url, headers=headers, data=body_json, verify=True)
+        # Requests from several threads are sent concurrently, so one can arrive after a request with a later nonce.
+        # Bitfinex then rejects it without executing it, and it is signed again with a fresh nonce and resent.
+        for _ in range(_NONCE_ATTEMPTS):
+            signed_headers = self._secure_headers(path, next_nonce(), body_json, headers)
+            resp = requests.post(url, headers=signed_headers, data=body_json, verify=True)
+            if not _is_nonce_rejection(resp):
+                break
+        return resp
 
     def request_public_data(self, path, params: dict = None, headers: dict = None):
         """
@@ -1,11 +1,59 @@
-from pydantic import BaseSettings
+import os
+from dataclasses import dataclass
 
+from bf_duster.errors import SettingsException
 
-class Settings(BaseSettings):
+_ENV_PREFIX = 'bf_'
+
+
+def _read_env_file(path: str) -> dict[str, str]:
+    """
+    Read KEY=VALUE pairs from a dotenv file. Blank lines and comments are ignored, surrounding quotes are stripped.
+    """
+    values = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return values
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        key = key.strip()
+        if key.startswith('export '):
+            key = key[len('export '):].strip()
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        values[key.lower()] = value
+    return values
+
+
+@dataclass(frozen=True)
+class Settings:
     api_key: str
     api_secret: str
 
-    class Config:
-        env_prefix = 'bf_'
-        env_file = '.env'
-        case_sensitive = False
+
+def load_settings(env_file: str = '.env') -> Settings:
+    """
+    Load settings from BF_ prefixed environment variables, falling back to the env file. Keys are case-insensitive
+    and environment variables take precedence over the env file.
+    """
+    values = _read_env_file(env_file)
+    values.update({k.lower(): v for k, v in os.environ.items()})
+
+    missing = []
+    kwargs = {}
+    for field in ('api_key', 'api_secret'):
+        value = values.get(_ENV_PREFIX + field)
+        if value is None:
+            missing.append((_ENV_PREFIX + field).upper())
+        kwargs[field] = value
+    if missing:
+        raise SettingsException(f"Missing settings: {', '.join(missing)}")
+
+    return Settings(**kwargs)
@@ -1,49 +1,79 @@
 import logging
-from decimal import Decimal
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal, ROUND_DOWN
+from itertools import chain
+from typing import Iterable, Iterator
 
 from bf_duster.errors import RepoException
 from bf_duster.market import MarketIndex, build_market_index
 from bf_duster.models import FundsTransferTransaction, CreateOrderTransaction, PricedPair
+from bf_duster.models import WalletEvaluation
 from bf_duster.models import Wallet
-from bf_duster.output import format_create_order_transaction, format_funds_transfer_transaction
+from bf_duster.output import ResultWriter, TextResultWriter
+from bf_duster.plan_cache import PlanCache, wallet_key
 from bf_duster.repo import IRepo
 
 _logger = logging.getLogger(__name__)
 
+# number of submitted orders confirmed with a single batch of status requests
+_CONFIRM_BATCH_SIZE = 20
+# market orders usually fill immediately; orders that are still active are polled again a few times
+_CONFIRM_ATTEMPTS = 3
+_CONFIRM_RETRY_DELAY_SECONDS = 0.5
+# Bitfinex accepts order amounts with at most 8 decimals on every trading pair
+_AMOUNT_STEP = Decimal('1E-8')
 
-def process_all(repo: IRepo, max_value_usd: Decimal = Decimal('10')):
+
+def process_all(
+        repo: IRepo,
+        max_value_usd: Decimal = Decimal('10'),
+        writer: ResultWriter = None,
+        plan_cache: PlanCache = None,
+):
     """
     Move all funds from margin wallets to exchange wallets and then try to convert dust to btc either by converting
-    directly to btc or by converting to usd first and then to btc.
+    directly to btc or by pooling it in usd or ust first and then converting each pool to btc.
+
+    Wallets that convert directly are submitted as soon as they are evaluated. Wallets that have to be pooled are
+    planned once the whole wallet set is known, so the sweep uses as few orders as possible. Every result is handed
+    to the writer as soon as it completes. Results are printed as text if no writer is given. A plan cache lets
+    wallets that did not change since the previous sweep skip valuation.
     """
-    margin_wallet_transactions = _process_margin_wallets(repo)
-    for t in margin_wallet_transactions:
+    writer = writer or TextResultWriter()
+
+    for t in _iter_margin_wallets(repo):
         _logger.info(
             "Wallet transfer %s %s -> %s %s. Amount: %.6f. Success: %s. Message: %s",
             t.wallet_from, t.currency_from, t.wallet_to, t.currency_to, t.amount, t.success, t.message
         )
-        print(format_funds_transfer_transaction(t))
+        writer.write_transfer(t)
 
     tickers = repo.get_tickers()
     trading_pairs = repo.get_trading_pairs()
     trading_pair_index = build_market_index(trading_pairs, tickers)
 
-    # attempt to convert dust to btc or if that fails, to usd
-    ignored_currencies = ['btc', 'usd']
-    target_currencies = ['btc', 'usd']
-    dust_transactions = _process_exchange_dust(
-        repo, trading_pair_index, max_value_usd, ignored_currencies, target_currencies
+    target_currency = 'btc'
+    intermediate_currencies = ['usd', 'ust']
+    # filled by the dust stage once every wallet was planned, before the pool stage reads it
+    pooled_currencies = []
+    orders = _iter_consolidation_orders(
+        repo.iter_wallets(), trading_pair_index, max_value_usd, target_currency, intermediate_currencies,
+        pooled_currencies, plan_cache
     )
+    dust_transactions = _iter_create_order_transactions(repo, orders)
 
-    usd_tables = {'usd', 'ust'}
-    usd_wallets = [w for w in repo.get_wallets() if w.currency in usd_tables]
-
-    final_transactions = [_create_order_transaction(w, 'btc', pair_index=trading_pair_index) for w in usd_wallets]
-    final_transactions = _process_create_order_transactions(repo, final_transactions)
+    # the pool stage pulls wallets only once the dust stage is exhausted so it sees the converted balances
+    final_transactions = _iter_pooled_to_target(repo, trading_pair_index, pooled_currencies, target_currency)
 
-    dust_transactions.extend(final_transactions)
+    # fills are confirmed in the background; the pool stage starts only once every dust order is confirmed
+    transactions = chain(
+        _iter_confirmed_transactions(repo, dust_transactions),
+        _iter_confirmed_transactions(repo, final_transactions),
+    )
 
-    for t in dust_transactions:
+    for t in transactions:
         side = 'buy' if t.amount > 0 else 'sell'
         result = 'success' if t.success else 'failed'
         _logger.info(
@@ -53,122 +83,377 @@ def process_all(repo: IRepo, max_value_usd: Decimal = Decimal('10')):
             result,
             t.message
         )
-        print(format_create_order_transaction(t))
+        writer.write_order(t)
+    writer.flush()
 
 
-def _process_margin_wallets(repo: IRepo) -> list[FundsTransferTransaction]:
+def _iter_margin_wallets(repo: IRepo) -> Iterator[FundsTransferTransaction]:
     """
-    Move all funds from margin wallets to exchange wallets and return a list of attempted transactions.
+    Lazily move funds from margin wallets to exchange wallets, yielding each transaction once it was attempted.
     """
-    wallets = repo.get_wallets()
-
-    transfer_transactions = _create_margin_to_exchange_transactions(wallets)
-    for t in transfer_transactions:
+    for t in _iter_margin_to_exchange_transactions(repo.iter_wallets()):
         try:
             repo.transfer(t.wallet_from, t.wallet_to, t.currency_from, t.currency_to, t.amount)
             t.success = True
         except RepoException as e:
             t.message = str(e)
             t.success = False
+        yield t
 
-    return transfer_transactions
 
-
-def _create_margin_to_exchange_transactions(wallets: list[Wallet]) -> list[FundsTransferTransaction]:
+def _iter_margin_to_exchange_transactions(wallets: Iterable[Wallet]) -> Iterator[FundsTransferTransaction]:
     """
-    Create a list of funds transfer transactions from margin wallets to exchange wallets.
+    Lazily create funds transfer transactions from margin wallets to exchange wallets.
     """
-    wallets = [w for w in wallets if w.type == 'margin' if w.balance_available > 0]
-    return [
-        FundsTransferTransaction(
+    for w in wallets:
+        if w.type != 'margin' or w.balance_available <= 0:
+            continue
+        yield FundsTransferTransaction(
             wallet_from=w.type,
             wallet_to='exchange',
             currency_from=w.currency,
             currency_to=w.currency[:3],
             amount=w.balance_available,
         )
-        for w in wallets
-    ]
 
 
-def _process_exchange_dust(
+def _iter_pooled_to_target(
         repo: IRepo,
         pair_index: MarketIndex,
-        max_value_usd: Decimal,
-        ignored_currencies: list[str],
-        target_currencies: list[str]
-) -> list[CreateOrderTransaction]:
+        pooled_currencies: list[str],
+        target_currency: str,
+) -> Iterator[CreateOrderTransaction]:
     """
-    Create dust transactions and process them. Return a list of attempted transactions.
+    Lazily convert the pooled exchange wallets to the target currency. Wallets are only requested once the first
+    transaction is pulled so the orders are sized from the balances left by the dust stage.
     """
-    wallets = repo.get_wallets()
-    dust_transactions = _create_dust_transactions(
-        wallets, pair_index, max_value_usd, ignored_currencies, target_currencies
+    if not pooled_currencies:
+        return
+    wallets = (w for w in repo.iter_wallets() if w.type == 'exchange' and w.currency in pooled_currencies)
+    transactions = (
+        _create_order_transaction(w, target_currency, pair_index) for w in wallets if w.balance_available > 0
     )
-    return _process_create_order_transactions(repo, dust_transactions)
+    yield from _iter_create_order_transactions(repo, (t for t in transactions if t))
 
 
-def _process_create_order_transactions(
+def _iter_create_order_transactions(
         repo: IRepo,
-        transactions: list[CreateOrderTransaction]
-) -> list[CreateOrderTransaction]:
+        transactions: Iterable[CreateOrderTransaction]
+) -> Iterator[CreateOrderTransaction]:
     """
-    Process a list of create order transactions and return the list with the success flag set and
-    set an error message if the transaction fails.
+    Submit create order transactions one at a time as they are pulled, setting the success flag and an error
+    message if the transaction fails.
     """
     for t in transactions:
         try:
-            repo.create_order(t.type, t.trading_symbol, t.amount)
+            t.order_id = repo.create_order(t.type, t.trading_symbol, t.amount)
             t.success = True
         except RepoException as e:
             t.message = str(e)
             t.success = False
-    return transactions
+        yield t
 
 
-def _create_dust_transactions(
-        wallets: list[Wallet],
-        trading_pair_index: MarketIndex,
-        max_value_usd: Decimal,
-        ignored_currencies: list[str] = None,
-        target_currencies: list[str] = None,
-) -> list[CreateOrderTransaction]:
+def _iter_confirmed_transactions(
+        repo: IRepo,
+        transactions: Iterable[CreateOrderTransaction],
+        batch_size: int = _CONFIRM_BATCH_SIZE,
+) -> Iterator[CreateOrderTransaction]:
+    """
+    Confirm the fills of submitted orders in batches on a background thread while the submission stage keeps pulling
+    transactions. Failed or untracked transactions are yielded right away, confirmed ones as soon as their batch is
+    done.
+    """
+    pending: deque[tuple[Future, list[CreateOrderTransaction]]] = deque()
+    batch = []
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='order-confirm') as executor:
+        for t in transactions:
+            if not t.success or t.order_id is None:
+                yield t
+            else:
+                batch.append(t)
+                if len(batch) >= batch_size:
+                    pending.append((executor.submit(_confirm_order_transactions, repo, batch), batch))
+                    batch = []
+
+            while pending and pending[0][0].done():
+                yield from _completed_batch(*pending.popleft())
+
+        if batch:
+            pending.append((executor.submit(_confirm_order_transactions, repo, batch), batch))
+        while pending:
+            yield from _completed_batch(*pending.popleft())
+
+
+def _completed_batch(future: Future, batch: list[CreateOrderTransaction]) -> list[CreateOrderTransaction]:
     """
-    Create a list of dust transactions. A dust transaction is a transaction that converts dust to the first available
-    currency from the list of target_currencies.
+    Wait for a confirmation batch and return its transactions. The orders were already placed, so no confirmation
+    failure, including an unexpected response payload, may fail the sweep; the batch is marked unconfirmed instead.
     """
-    wallets = [w for w in wallets if w.type == 'exchange']
-    wallets = [w for w in wallets if w.currency not in ignored_currencies]
+    try:
+        future.result()
+    except Exception as e:
+        _logger.warning(
+            "Could not confirm fills for %d orders: %s", len(batch), e, exc_info=not isinstance(e, RepoException)
+        )
+        for t in batch:
+            t.message = f"Could not confirm fill: {e}"
+            if t.order_status is None:
+                t.order_status = 'UNCONFIRMED'
+    return batch
 
-    transactions = []
 
+def _confirm_order_transactions(
+        repo: IRepo,
+        transactions: list[CreateOrderTransaction],
+        attempts: int = _CONFIRM_ATTEMPTS,
+        retry_delay: float = _CONFIRM_RETRY_DELAY_SECONDS,
+):
+    """
+    Record the status, fill price and fee of each submitted order. Orders that are still active are polled again up
+    to the given number of attempts.
+    """
+    unconfirmed = {t.order_id: t for t in transactions}
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(retry_delay)
+        for fill in repo.get_order_fills(list(unconfirmed)):
+            t = unconfirmed.pop(fill.order_id, None)
+            if t is None:
+                continue
+            t.order_status = fill.status
+            t.fill_price = fill.fill_price
+            t.fee = fill.fee
+            t.fee_currency = fill.fee_currency
+        if not unconfirmed:
+            return
+
+    for t in unconfirmed.values():
+        _logger.info("Order %s for %s is still active", t.order_id, t.trading_symbol)
+        t.order_status = 'ACTIVE'
+
+
+def _iter_dust_wallets(wallets: Iterable[Wallet], ignored_currencies: list[str]) -> Iterator[Wallet]:
+    """
+    Filter stage: keep non-empty exchange wallets that are not in the ignored currencies.
+    """
     for w in wallets:
+        if w.type != 'exchange' or w.currency in ignored_currencies:
+            continue
         if w.balance_available == 0:
             continue
+        yield w
+
 
-        coin_in_usd = trading_pair_index.get_value_of(w.currency, 'usd', 'btc')
-        if coin_in_usd is None:
-            _logger.debug("Skipping %s because it can not be priced in usd", w.currency)
+def _iter_consolidation_orders(
+        wallets: Iterable[Wallet],
+        trading_pair_index: MarketIndex,
+        max_value_usd: Decimal,
+        target_currency: str,
+        intermediate_currencies: list[str],
+        pooled_currencies: list[str],
+        plan_cache: PlanCache = None,
+) -> Iterator[CreateOrderTransaction]:
+    """
+    Plan stage: lazily yield the smallest set of orders that consolidates the exchange wallets into the target
+    currency.
+
+    A wallet is converted directly when it clears the minimum order size of a pair with the target currency, and its
+    order is yielded as soon as the wallet is evaluated. Otherwise it is routed into an intermediate currency and
+    every intermediate pool is converted to the target with a single order once the dust orders filled. Only pooling
+    needs the whole wallet set, so routed orders are yielded once every wallet was pulled. Sub-minimum balances are
+    pooled in as few intermediates as possible so they clear the minimum together; wallets whose pool could never
+    reach the target are left untouched. The intermediate currencies to convert afterwards are appended to
+    pooled_currencies once the routed orders are planned.
+
+    When a plan cache is given, wallets whose balance did not change and whose prices stayed within the cached band
+    reuse their previous evaluation instead of being valued again.
+    """
+    pools = {}
+    routable = []
+    for w in _iter_dust_wallets(wallets, [target_currency]):
+        if w.currency in intermediate_currencies:
+            pools[w.currency] = pools.get(w.currency, Decimal(0)) + w.balance_available
             continue
 
-        wallet_value_in_usd = coin_in_usd * w.balance_available
-        if wallet_value_in_usd > max_value_usd:
-            _logger.info(
-                "Skipping %s. Max value is $%.6f. Wallet value is $%.6f (%.6f %s)",
-                w.currency, max_value_usd, wallet_value_in_usd, w.balance_available, w.currency
-            )
+        evaluation = None
+        if plan_cache is not None:
+            key = wallet_key(w, max_value_usd, target_currency, intermediate_currencies)
+            evaluation = plan_cache.get(key, trading_pair_index)
+        if evaluation is None:
+            evaluation = _evaluate_wallet(w, trading_pair_index, max_value_usd, target_currency, intermediate_currencies)
+            if plan_cache is not None:
+                plan_cache.put(key, evaluation)
+
+        if evaluation.decision == 'direct':
+            if evaluation.order_symbol is not None:
+                transaction = CreateOrderTransaction.construct(
+                    type='EXCHANGE MARKET', trading_symbol=evaluation.order_symbol, amount=evaluation.order_amount
+                )
+            else:
+                transaction = _create_order_transaction(w, target_currency, trading_pair_index)
+            if transaction:
+                yield transaction
             continue
 
-        # attempt to convert to one of the target currencies
-        for to_currency in [c for c in target_currencies if c != w.currency]:
-            transaction = _create_order_transaction(w, to_currency, trading_pair_index)
+        routes = {}
+        for currency in evaluation.routes:
+            transaction = _create_order_transaction(w, currency, trading_pair_index)
             if transaction:
-                transactions.append(transaction)
-                break
+                routes[currency] = (transaction, _estimate_proceeds(transaction, trading_pair_index))
+        if routes:
+            routable.append((w, routes))
+
+    if plan_cache is not None:
+        _logger.info("Plan cache reused %d and evaluated %d wallets", plan_cache.hits, plan_cache.misses)
+
+    # pools that would not clear the minimum to the target are excluded and their wallets re-routed to the others
+    excluded = set()
+    while True:
+        candidates = [(w, {c: r for c, r in routes.items() if c not in excluded}) for w, routes in routable]
+        assignments = _assign_pools([c for c in candidates if c[1]], pools, intermediate_currencies)
+        infeasible = {
+            currency for currency, routed in assignments.items()
+            if not _pool_clears_minimum(
+                currency, pools.get(currency, 0) + sum(proceeds for _, proceeds in routed),
+                target_currency, trading_pair_index
+            )
+        }
+        if not infeasible:
+            break
+        excluded.update(infeasible)
+
+    for w, routes in candidates:
+        if not routes:
+            _logger.info(
+                "Skipping %s. Pooling it in %s would not clear the minimum order size to %s",
+                w.currency, ', '.join(sorted(excluded)), target_currency
+            )
+
+    pooled_currencies.extend(c for c in intermediate_currencies if c in pools or c in assignments)
+    for routed in assignments.values():
+        yield from (t for t, _ in routed)
 
+
+def _evaluate_wallet(
+        w: Wallet,
+        trading_pair_index: MarketIndex,
+        max_value_usd: Decimal,
+        target_currency: str,
+        intermediate_currencies: list[str],
+) -> WalletEvaluation:
+    """
+    Value a wallet and decide whether it is skipped, converted directly into the target currency or routed into one
+    of the intermediate currencies. The evaluation also records the prices the decision depends on and how close the
+    wallet was to the nearest decision boundary, so it can be reused while those prices stay close. Every value comes
+    from already validated models, so the evaluation is built without validating it again.
+    """
+    usd_price = trading_pair_index.get_value_of(w.currency, 'usd', 'btc')
+    if usd_price is None:
+        _logger.debug("Skipping %s because it can not be priced in usd", w.currency)
+        return WalletEvaluation.construct(currency=w.currency, decision='skip')
+
+    balance = w.balance_available
+    wallet_value_in_usd = usd_price * balance
+    margins = [_relative_distance(wallet_value_in_usd, max_value_usd)]
+    if wallet_value_in_usd > max_value_usd:
+        _logger.info(
+            "Skipping %s. Max value is $%.6f. Wallet value is $%.6f (%.6f %s)",
+            w.currency, max_value_usd, wallet_value_in_usd, w.balance_available, w.currency
+        )
+        return WalletEvaluation.construct(
+            currency=w.currency, decision='skip', usd_price=usd_price, margin=min(margins)
+        )
+
+    pair_prices = {}
+    pairs = {}
+    pair_minimums = {}
+    routes = []
+    for currency in [target_currency] + intermediate_currencies:
+        usable_pairs = trading_pair_index.find_pairs(w.currency, currency)
+        pairs[currency] = usable_pairs[0].symbol if usable_pairs else None
+        if usable_pairs:
+            pair = usable_pairs[0]
+            pair_minimums[pair.symbol] = pair.min_order_size
+            if w.currency == pair.quote:
+                # buy orders are sized from the price so the minimum order size check depends on it
+                price = pair.last_price
+                pair_prices[pair.symbol] = price
+                if price > 0:
+                    margins.append(_relative_distance(balance / price, pair.min_order_size))
+
+        transaction = _create_order_transaction(w, currency, trading_pair_index)
+        if transaction:
+            if currency == target_currency:
+                # a sell is sized from the balance alone so a cache hit reuses it; a buy is sized again from the price
+                sell = transaction.amount < 0
+                return WalletEvaluation.construct(
+                    currency=w.currency, decision='direct', usd_price=usd_price, pair_prices=pair_prices,
+                    pairs=pairs, pair_minimums=pair_minimums, margin=min(margins),
+                    order_symbol=transaction.trading_symbol if sell else None,
+                    order_amount=transaction.amount if sell else None,
+                )
+            routes.append(currency)
+
+    if not routes:
         _logger.debug("Could not exchange %s", w.currency)
+    return WalletEvaluation.construct(
+        currency=w.currency, decision='route' if routes else 'skip', routes=routes, usd_price=usd_price,
+        pair_prices=pair_prices, pairs=pairs, pair_minimums=pair_minimums, margin=min(margins),
+    )
 
-    return transactions
+
+def _relative_distance(value: Decimal, boundary: Decimal) -> Decimal:
+    """
+    Relative distance of a value from a decision boundary.
+    """
+    if value == 0:
+        return 0
+    return abs(value - boundary) / abs(value)
+
+
+def _pool_clears_minimum(
+        currency: str, amount: Decimal, target_currency: str, trading_pair_index: MarketIndex
+) -> bool:
+    """
+    Check if a pool of the given amount of currency can be converted to the target currency.
+    """
+    pool_wallet = Wallet(type='exchange', currency=currency, balance_available=amount)
+    return _create_order_transaction(pool_wallet, target_currency, trading_pair_index) is not None
+
+
+def _assign_pools(
+        routable: list[tuple[Wallet, dict[str, tuple[CreateOrderTransaction, Decimal]]]],
+        pools: dict[str, Decimal],
+        intermediate_currencies: list[str],
+) -> dict[str, list[tuple[CreateOrderTransaction, Decimal]]]:
+    """
+    Assign every routable wallet to one intermediate currency so that as few pools as possible are used. Pools are
+    picked greedily by the number of remaining wallets they can take, preferring pools that already hold a balance
+    since their conversion order is paid for anyway.
+    """
+    assignments = {}
+    remaining = list(routable)
+    while remaining:
+        currency = max(
+            intermediate_currencies,
+            key=lambda c: (sum(1 for _, routes in remaining if c in routes), pools.get(c, 0) > 0),
+        )
+        assignments[currency] = [routes[currency] for _, routes in remaining if currency in routes]
+        remaining = [(w, routes) for w, routes in remaining if currency not in routes]
+    return assignments
+
+
+def _estimate_proceeds(transaction: CreateOrderTransaction, trading_pair_index: MarketIndex) -> Decimal:
+    """
+    Estimate at the last price how much of the counter currency an order yields.
+    """
+    amount = transaction.amount
+    if amount > 0:
+        return amount
+    pair = trading_pair_index.get_pair_by_symbol(transaction.trading_symbol[1:])
+    return -amount * pair.last_price
 
 
 def _create_order_transaction(
@@ -197,9 +482,13 @@ def _create_buy_transaction(
         pair: PricedPair
 ) -> CreateOrderTransaction | None:
     """
-    Create a buy order transaction for a wallet and a target currency using a trading pair.
+    Create a buy order transaction for a wallet and a target currency using a trading pair. The order size is
+    truncated to the amount precision accepted by Bitfinex so it never costs more than the available balance.
     """
-    order_size = balance_available / pair.last_price
+    if pair.last_price <= 0:
+        _logger.debug("Cannot create BUY order for %s. Last price is %s", pair.symbol, pair.last_price)
+        return
+    order_size = _round_amount(balance_available / pair.last_price)
     if order_size < pair.min_order_size:
         _logger.debug(
             "Cannot create BUY order for %s. Minimum order size is %s %s and available "
@@ -221,9 +510,11 @@ def _create_sell_transaction(
         pair: PricedPair
 ) -> CreateOrderTransaction | None:
     """
-    Create a sell order transaction for a wallet and a target currency using a trading pair.
+    Create a sell order transaction for a wallet and a target currency using a trading pair. The order size is
+    truncated to the amount precision accepted by Bitfinex.
     """
-    if balance_available < pair.min_order_size:
+    order_size = _round_amount(balance_available)
+    if order_size < pair.min_order_size:
         _logger.debug(
             "Cannot create SELL order for %s. Minimum order size is %s %s and available "
             "balance is %s %s",
@@ -233,5 +524,12 @@ def _create_sell_transaction(
     return CreateOrderTransaction(
         type='EXCHANGE MARKET',
         trading_symbol=f"t{pair.symbol}",
-        amount=balance_available * -1,
+        amount=-order_size,
     )
+
+
+def _round_amount(value: Decimal) -> Decimal:
+    """
+    Truncate an order amount towards zero to the precision accepted by Bitfinex.
+    """
+    return value.quantize(_AMOUNT_STEP, rounding=ROUND_DOWN)
@@ -0,0 +1,264 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from bf_duster.errors import RepoException
+from bf_duster.model_decoders import decode_order_status, decode_stream_wallet
+from bf_duster.models import Wallet
+from bf_duster.rest_client import next_nonce
+
+_logger = logging.getLogger(__name__)
+
+WS_URL = 'wss://api.bitfinex.com/ws/2'
+
+# Bitfinex sends a heartbeat on the account channel every 15 seconds, so a longer silence means the connection is gone
+_IDLE_TIMEOUT_SECONDS = 30
+
+
+class WalletStore:
+    """
+    Thread-safe local copy of the wallets of an account, keyed by wallet type and currency. It counts the updates
+    applied to each wallet and remembers the status of closed orders so readers can wait for the effects of their
+    own writes. Wallets whose available balance Bitfinex has not calculated yet keep their previous value, or are
+    left out if they have none, until the calculated balance arrives.
+    """
+
+    def __init__(self):
+        self._wallets: dict[tuple[str, str], Wallet] = {}
+        self._uncalculated: set[tuple[str, str]] = set()
+        self._updates: dict[tuple[str, str], int] = {}
+        self._closed_orders: dict[int, str] = {}
+        self._condition = threading.Condition()
+        self._has_snapshot = False
+        self.connected = True
+
+    def apply_snapshot(self, wallets: list[Wallet], uncalculated: list[tuple[str, str]]):
+        with self._condition:
+            self._wallets = {(w.type, w.currency): w for w in wallets}
+            self._uncalculated = set(uncalculated)
+            self._has_snapshot = True
+            self._condition.notify_all()
+
+    def apply_update(self, w: Wallet):
+        with self._condition:
+            key = (w.type, w.currency)
+            self._wallets[key] = w
+            self._uncalculated.discard(key)
+            self._updates[key] = self._updates.get(key, 0) + 1
+            self._condition.notify_all()
+
+    def apply_uncalculated_update(self, key: tuple[str, str]):
+        """
+        Record that a wallet changed but its available balance has not been calculated yet.
+        """
+        with self._condition:
+            self._uncalculated.add(key)
+            self._updates[key] = self._updates.get(key, 0) + 1
+            self._condition.notify_all()
+
+    def apply_order_closed(self, order_id: int, status: str):
+        with self._condition:
+            self._closed_orders[order_id] = status
+            self._condition.notify_all()
+
+    def disconnect(self):
+        """
+        Mark the store as no longer kept up to date, which wakes up every reader waiting on it.
+        """
+        with self._condition:
+            self.connected = False
+            self._condition.notify_all()
+
+    def wallets(self) -> list[Wallet]:
+        with self._condition:
+            return list(self._wallets.values())
+
+    def update_counts(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], int]:
+        """
+        Get the number of updates applied so far to each of the wallets, keyed by wallet type and currency.
+        """
+        with self._condition:
+            return {key: self._updates.get(key, 0) for key in keys}
+
+    def wait_for_snapshot(self, timeout: float) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self._has_snapshot, timeout)
+
+    def wait_for_sync(
+            self,
+            wallet_updates: dict[tuple[str, str], int],
+            orders: dict[int, dict[tuple[str, str], int]],
+            timeout: float,
+    ) -> bool:
+        """
+        Wait until every wallet in wallet_updates was updated more often than the given count, every order in
+        orders closed and every available balance is calculated. Orders that filled also wait for an update of each
+        of their wallets. Returns False if that did not happen within the timeout or the store got disconnected.
+        """
+        def updated(counts: dict[tuple[str, str], int]) -> bool:
+            return all(self._updates.get(key, 0) > count for key, count in counts.items())
+
+        def synced() -> bool:
+            for order_id, counts in orders.items():
+                status = self._closed_orders.get(order_id)
+                # a status like EXECUTED @ 0.05(-1.0) or CANCELED was: PARTIALLY FILLED @ ... means funds moved
+                if status is None or ('@' in status and not updated(counts)):
+                    return False
+            return updated(wallet_updates) and not self._uncalculated
+
+        with self._condition:
+            self._condition.wait_for(lambda: not self.connected or synced(), timeout)
+            return self.connected and synced()
+
+
+def _wallet_key(wallet_data: list) -> tuple[str, str]:
+    """
+    Get the store key of a wallet in a websocket wallet message, in the same case as the decoded wallet.
+    """
+    return wallet_data[0].lower(), wallet_data[1].lower()
+
+
+def _create_connection(url: str, timeout: float) -> Any:
+    """
+    Open a websocket connection with websocket-client, which is only needed when the wallet stream is used. The
+    timeout applies to connecting and to every receive.
+    """
+    try:
+        import websocket
+    except ImportError as e:
+        raise RepoException("The wallet stream needs the ws extra: poetry install --extras ws") from e
+    try:
+        return websocket.create_connection(url, timeout=timeout)
+    except (OSError, websocket.WebSocketException) as e:
+        raise RepoException(f"Could not connect to {url}") from e
+
+
+class WalletStream:
+    """
+    Authenticated Bitfinex websocket connection that receives the wallet snapshot once and then keeps a wallet store
+    up to date with wallet update and order close messages on a background thread. The store is disconnected when
+    the connection stops.
+
+    The connection factory is called with the url and a timeout in seconds and must return an object with send(str),
+    recv() -> str, settimeout(float) and close(). recv() must raise once the timeout passes without a message.
+    """
+
+    def __init__(
+            self,
+            api_key: str,
+            api_secret: str,
+            store: WalletStore = None,
+            url: str = WS_URL,
+            create_connection: Callable[[str, float], Any] = _create_connection,
+    ):
+        self._api_key = api_key
+        self._api_secret = api_secret.encode(encoding='UTF-8')
+        self._url = url
+        self._create_connection = create_connection
+        self._connection = None
+        self._thread = None
+        self._closing = False
+        self.store = store or WalletStore()
+
+    def _auth_message(self) -> str:
+        # Bitfinex requires the nonces of an API key to increase across REST and websocket, so both use one source
+        nonce = next_nonce()
+        payload = 'AUTH' + nonce
+        signature = hmac.new(self._api_secret, payload.encode(encoding='UTF-8'), hashlib.sha384).hexdigest()
+        return json.dumps({
+            'event': 'auth',
+            'apiKey': self._api_key,
+            'authSig': signature,
+            'authPayload': payload,
+            'authNonce': nonce,
+            'filter': ['wallet', 'trading'],
+        })
+
+    def start(self, timeout: float = 10):
+        """
+        Connect, authenticate and wait until the wallet snapshot has been received, all within timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            self._connection = self._create_connection(self._url, timeout)
+            self._connection.send(self._auth_message())
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RepoException("Timed out waiting for the wallet stream authentication")
+                self._connection.settimeout(remaining)
+                message = json.loads(self._connection.recv())
+                if isinstance(message, dict) and message.get('event') == 'auth':
+                    if message.get('status') != 'OK':
+                        raise RepoException(f"Wallet stream authentication failed: {message.get('msg')}")
+                    break
+                self._handle(message)
+        except RepoException:
+            self.close()
+            raise
+        except Exception as e:  # the connection reports timeouts and closed sockets with its own exception types
+            self.close()
+            raise RepoException(f"Could not start the wallet stream: {e!r}") from e
+
+        self._connection.settimeout(_IDLE_TIMEOUT_SECONDS)
+        self._thread = threading.Thread(target=self._run, name='wallet-stream', daemon=True)
+        self._thread.start()
+        if not self.store.wait_for_snapshot(max(deadline - time.monotonic(), 0)):
+            self.close()
+            raise RepoException("Timed out waiting for the wallet snapshot")
+
+    def _run(self):
+        try:
+            while not self._closing:
+                raw = self._connection.recv()
+                if raw:
+                    self._handle(json.loads(raw))
+        except Exception as e:  # the connection reports a closed socket with its own exception types
+            if not self._closing:
+                _logger.warning("Wallet stream stopped: %s", e)
+        finally:
+            # readers fall back to REST once nothing keeps the store up to date
+            self.store.disconnect()
+
+    def _handle(self, message):
+        """
+        Apply a wallet snapshot (ws), wallet update (wu) or order close (oc) message. Heartbeats and other events
+        are ignored.
+        """
+        if not isinstance(message, list) or len(message) < 3 or message[0] != 0:
+            return
+        if message[1] == 'ws':
+            wallets = [(d, decode_stream_wallet(d)) for d in message[2]]
+            uncalculated = [d for d, w in wallets if w is None]
+            self.store.apply_snapshot([w for _, w in wallets if w is not None], [_wallet_key(d) for d in uncalculated])
+            self._request_calculation(uncalculated)
+        elif message[1] == 'wu':
+            w = decode_stream_wallet(message[2])
+            if w is None:
+                self.store.apply_uncalculated_update(_wallet_key(message[2]))
+                self._request_calculation([message[2]])
+            else:
+                self.store.apply_update(w)
+        elif message[1] == 'oc':
+            order_id, status, _ = decode_order_status(message[2])
+            self.store.apply_order_closed(order_id, status)
+
+    def _request_calculation(self, wallet_data: list[list]):
+        """
+        Ask Bitfinex to calculate the available balances of the wallets, which it sends back as wallet updates.
+        """
+        if wallet_data:
+            requests = [[f"wallet_{d[0]}_{d[1]}"] for d in wallet_data]
+            self._connection.send(json.dumps([0, 'calc', None, requests]))
+
+    def close(self):
+        self._closing = True
+        if self._connection is not None:
+            self._connection.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
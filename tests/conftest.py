@@ -0,0 +1,14 @@
+import pytest
+
+from bf_duster.models import PricedPair
+
+
+@pytest.fixture
+def make_pair():
+    def pair(symbol, last_price, min_order_size):
+        return PricedPair(
+            symbol=symbol, base=symbol[:3], quote=symbol[3:], min_order_size=min_order_size, max_order_size=1000000,
+            last_price=last_price,
+        )
+
+    return pair
@@ -0,0 +1,58 @@
+import gzip
+import json
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bf_duster.cassette import Cassette, RecordingRestClient, ReplayRestClient
+from bf_duster.errors import CassetteException
+from bf_duster.repo import BitfinexRepo
+
+
+def _http_response(data, status_code=200):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.text = json.dumps(data)
+    return resp
+
+
+def test_record_and_replay_round_trip(tmp_path):
+    wallets = [["exchange", "ETH", 1, 0, 0.5, None, None]]
+    with patch("bf_duster.rest_client.requests") as mock_requests:
+        mock_requests.post.side_effect = [_http_response(wallets), _http_response(["error", 10100, "apikey: invalid"], 500)]
+        mock_requests.get.return_value = _http_response([["tETHBTC", 0, 0, 0, 0, 0, 0, 0.0625]])
+        client = RecordingRestClient("https://api.bitfinex.com/", "my-api-key", "my-api-secret")
+        client.request_securely("v2/auth/r/wallets")
+        client.request_securely("v2/auth/r/wallets")
+        client.request_public_data("v2/tickers", params={"symbols": "ALL"})
+
+    path = tmp_path / "sweep.json.gz"
+    client.cassette.save(str(path))
+
+    raw = gzip.open(path, "rt").read()
+    for secret in ["my-api-key", "my-api-secret", "bfx-signature", "bfx-nonce"]:
+        assert secret not in raw
+
+    repo = BitfinexRepo(ReplayRestClient(Cassette.load(str(path))))
+    w = repo.get_wallets()
+    assert w[0].currency == "eth"
+    assert w[0].balance_available == Decimal("0.5")
+    assert repo.get_tickers()[0].last_price == Decimal("0.0625")
+
+    with pytest.raises(Exception, match="10100"):
+        repo.get_wallets()
+    with pytest.raises(CassetteException):
+        repo.get_wallets()
+
+
+def test_replay_scales_recorded_latency():
+    cassette = Cassette([
+        {"method": "GET", "path": "v2/tickers", "params": {}, "status": 200, "body": "[]", "elapsed": 0.2},
+    ])
+    with patch("bf_duster.cassette.time.sleep") as mock_sleep:
+        resp = ReplayRestClient(cassette, latency_scale=0.5).request_public_data("v2/tickers")
+
+    mock_sleep.assert_called_once_with(0.1)
+    assert resp.status_code == 200
+    assert resp.json() == []
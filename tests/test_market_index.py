@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from bf_duster.market import MarketIndex
 from bf_duster.models import PricedPair
 
@@ -40,3 +42,20 @@ def test_market_index_find_pairs():
     p = m.find_pairs("BTC", "USD")
     assert len(p) == 1, "Should find one pair"
     assert p[0].symbol == "btc:usd", "Should find the correct pair"
+
+
+def test_market_index_get_value_of():
+    priced_pairs = [
+        PricedPair(
+            symbol="BTCUSD", last_price=28000, base="BTC", quote="USD", min_order_size=0.006, max_order_size=100.0
+        ),
+        PricedPair(
+            symbol="ETHBTC", last_price="0.0625", base="ETH", quote="BTC", min_order_size=0.1, max_order_size=100.0
+        ),
+    ]
+    m = MarketIndex(priced_pairs)
+
+    assert m.get_value_of("BTC", "USD") == Decimal(28000)
+    assert m.get_value_of("BTC", "ETH") == Decimal(16)
+    assert m.get_value_of("ETH", "USD") is None
+    assert m.get_value_of("ETH", "USD", "BTC") == Decimal(1750)
@@ -0,0 +1,16 @@
+from decimal import Decimal
+
+from bf_duster.model_decoders import decode_wallet
+from bf_duster.steps import _create_sell_transaction
+from bf_duster.models import PricedPair
+
+
+def test_decode_wallet_keeps_float_balances_exact():
+    w = decode_wallet(["exchange", "ETH", 0.3, 0, 0.3, None, None])
+    assert w.balance_available == Decimal("0.3")
+
+    pair = PricedPair(
+        symbol="ETHBTC", base="ETH", quote="BTC", min_order_size=0.01, max_order_size=100.0, last_price=0.05,
+    )
+    t = _create_sell_transaction(w.currency, w.balance_available, pair)
+    assert t.amount == Decimal("-0.3"), "The whole balance should be sold without leaving dust behind"
@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import threading
+from decimal import Decimal
+
+from bf_duster.models import CreateOrderTransaction, FundsTransferTransaction
+from bf_duster.output import BackgroundResultWriter, JsonLinesResultWriter, ResultWriter
+
+
+def _order():
+    return CreateOrderTransaction(
+        type="EXCHANGE MARKET", trading_symbol="tethbtc", amount=Decimal("-0.12345678"), success=True, order_id=7,
+        fill_price=Decimal("0.0625"), fee=Decimal("0.00000771"), fee_currency="BTC",
+    )
+
+
+def test_json_lines_writer_buffers_records():
+    stream = io.StringIO()
+    writer = JsonLinesResultWriter(stream, buffer_size=2)
+
+    writer.write_order(_order())
+    assert stream.getvalue() == "", "Records should be buffered until the buffer is full"
+
+    writer.write_transfer(FundsTransferTransaction(
+        wallet_from="margin", wallet_to="exchange", currency_from="ETH", currency_to="ETH", amount=Decimal("1.5"),
+    ))
+    writer.write_order(_order())
+    writer.close()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["kind"] for r in records] == ["order", "transfer", "order"]
+    assert records[0]["amount"] == "-0.12345678", "Decimals should be written without losing precision"
+    assert records[0]["side"] == "sell"
+    assert records[0]["order_id"] == 7
+    assert records[1]["amount"] == "1.5"
+
+
+def test_background_writer_does_not_block_on_slow_writer():
+    release = threading.Event()
+    written = []
+
+    class SlowWriter(ResultWriter):
+        def write_transfer(self, t):
+            pass
+
+        def write_order(self, t):
+            release.wait()
+            written.append(t)
+
+    writer = BackgroundResultWriter(SlowWriter())
+    for _ in range(3):
+        writer.write_order(_order())
+    assert written == [], "Writes should be queued while the wrapped writer is stalled"
+
+    release.set()
+    writer.close()
+    assert len(written) == 3
+
+
+def test_background_writer_reports_wrapped_writer_failure(caplog):
+    release = threading.Event()
+
+    class BrokenPipeWriter(ResultWriter):
+        def write_transfer(self, t):
+            pass
+
+        def write_order(self, t):
+            release.wait()
+            raise BrokenPipeError(32, "Broken pipe")
+
+    writer = BackgroundResultWriter(BrokenPipeWriter())
+    for _ in range(3):
+        writer.write_order(_order())
+
+    release.set()
+    with caplog.at_level(logging.ERROR, logger="bf_duster.output"):
+        writer.close()
+
+    assert not writer._thread.is_alive(), "The writer thread should stop on close instead of dying on the error"
+    assert len(caplog.records) == 1
+    assert "2 later results were dropped" in caplog.records[0].getMessage()
+    assert "BrokenPipeError" in caplog.records[0].getMessage()
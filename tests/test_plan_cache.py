@@ -0,0 +1,154 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+
+from bf_duster.market import MarketIndex
+from bf_duster.models import Wallet
+from bf_duster.plan_cache import PlanCache
+from bf_duster.steps import _create_order_transaction, _iter_consolidation_orders
+
+
+@pytest.fixture
+def market(make_pair):
+    def build(btc_usd="20000", eth_btc="0.005"):
+        return MarketIndex([
+            make_pair("BTCUSD", btc_usd, "0.0002"),
+            make_pair("ETHBTC", eth_btc, "0.01"),
+            make_pair("XRPBTC", "0.000002", "100"),
+        ])
+
+    return build
+
+
+@pytest.fixture
+def abc_market(make_pair):
+    def build(abc_btc_min, abc_usd_min="1", abc_ust_min=None):
+        pairs = [
+            make_pair("BTCUSD", "20000", "0.000001"),
+            make_pair("ABCBTC", "0.000001", abc_btc_min),
+            make_pair("ABCUSD", "0.02", abc_usd_min),
+        ]
+        if abc_ust_min is not None:
+            pairs += [make_pair("BTCUST", "20000", "0.000001"), make_pair("ABCUST", "0.02", abc_ust_min)]
+        return MarketIndex(pairs)
+
+    return build
+
+
+def _wallets(eth="0.05", xrp="200"):
+    return [
+        Wallet(type="exchange", currency="ETH", balance_available=Decimal(eth)),
+        Wallet(type="exchange", currency="XRP", balance_available=Decimal(xrp)),
+    ]
+
+
+def _plan(wallets, market, cache):
+    orders = _iter_consolidation_orders(wallets, market, Decimal(10), "btc", ["usd", "ust"], [], cache)
+    return [(t.trading_symbol, t.amount) for t in orders]
+
+
+def test_unchanged_wallets_reuse_cached_evaluations(tmp_path, market):
+    path = str(tmp_path / "plan-cache.json")
+    cache = PlanCache.load(path)
+    orders = _plan(_wallets(), market(), cache)
+    assert orders == [("tethbtc", Decimal("-0.05")), ("txrpbtc", Decimal("-200"))]
+    assert (cache.hits, cache.misses) == (0, 2)
+    cache.save(path)
+
+    cache = PlanCache.load(path)
+    assert _plan(_wallets(), market(btc_usd="20020"), cache) == orders, "A 0.1% move should reuse the plan"
+    assert (cache.hits, cache.misses) == (2, 0)
+
+    cache = PlanCache.load(path)
+    _plan(_wallets(eth="0.04"), market(), cache)
+    assert (cache.hits, cache.misses) == (1, 1), "A changed balance should be evaluated again"
+
+
+def test_cached_direct_sell_orders_are_reused(tmp_path, market):
+    path = str(tmp_path / "plan-cache.json")
+    cache = PlanCache.load(path)
+    orders = _plan(_wallets(), market(), cache)
+    cache.save(path)
+
+    cache = PlanCache.load(path)
+    with patch("bf_duster.steps._create_order_transaction", wraps=_create_order_transaction) as create:
+        assert _plan(_wallets(), market(btc_usd="20020"), cache) == orders
+    assert cache.hits == 2
+    create.assert_not_called()
+
+
+def test_cached_direct_buy_orders_are_sized_again(make_pair):
+    wallets = [Wallet(type="exchange", currency="ETH", balance_available=Decimal("0.05"))]
+    cache = PlanCache()
+    market = MarketIndex([make_pair("BTCUSD", "20000", "0.0002"), make_pair("BTCETH", "200", "0.0002")])
+    assert _plan(wallets, market, cache) == [("tbtceth", Decimal("0.00025"))]
+
+    # a 0.5% move stays within the band so the evaluation is reused but the order is sized at the new price
+    market = MarketIndex([make_pair("BTCUSD", "20000", "0.0002"), make_pair("BTCETH", "201", "0.0002")])
+    assert _plan(wallets, market, cache) == [("tbtceth", Decimal("0.00024875"))]
+    assert cache.hits == 1
+
+
+def test_price_moves_outside_the_band_are_evaluated_again(tmp_path, market):
+    cache = PlanCache()
+    _plan(_wallets(), market(), cache)
+
+    _plan(_wallets(), market(btc_usd="21000"), cache)
+    assert cache.misses == 4
+
+
+@pytest.mark.parametrize("btc_usd,expected", [("40020", []), ("39980", [("tethbtc", Decimal("-0.05"))])])
+def test_cached_decisions_near_a_boundary_are_evaluated_again(btc_usd, expected, market):
+    # 0.05 ETH at 0.005 BTC and 39990 USD is worth $9.9975, just below the $10 limit
+    cache = PlanCache()
+    assert _plan(_wallets(xrp="0"), market(btc_usd="39990"), cache) == [("tethbtc", Decimal("-0.05"))]
+
+    assert _plan(_wallets(xrp="0"), market(btc_usd=btc_usd), cache) == expected
+    assert cache.hits == 0, "A move larger than half the distance to the limit should not reuse the plan"
+
+
+def test_raised_minimum_order_size_re_routes_a_cached_direct_order(abc_market):
+    wallets = [Wallet(type="exchange", currency="ABC", balance_available=Decimal("5"))]
+    cache = PlanCache()
+    assert _plan(wallets, abc_market(abc_btc_min="1"), cache) == [("tabcbtc", Decimal("-5"))]
+
+    assert _plan(wallets, abc_market(abc_btc_min="10"), cache) == [("tabcusd", Decimal("-5"))]
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_lowered_minimum_order_size_re_plans_a_cached_skip(abc_market):
+    wallets = [Wallet(type="exchange", currency="ABC", balance_available=Decimal("5"))]
+    cache = PlanCache()
+    assert _plan(wallets, abc_market(abc_btc_min="10", abc_usd_min="10"), cache) == []
+
+    assert _plan(wallets, abc_market(abc_btc_min="1", abc_usd_min="10"), cache) == [("tabcbtc", Decimal("-5"))]
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_new_pair_re_plans_a_cached_skip(abc_market):
+    wallets = [Wallet(type="exchange", currency="ABC", balance_available=Decimal("5"))]
+    cache = PlanCache()
+    assert _plan(wallets, abc_market(abc_btc_min="10", abc_usd_min="10"), cache) == []
+
+    market = abc_market(abc_btc_min="10", abc_usd_min="10", abc_ust_min="1")
+    assert _plan(wallets, market, cache) == [("tabcust", Decimal("-5"))]
+    assert cache.misses == 2
+
+
+def test_unreadable_cache_is_ignored(tmp_path, market):
+    path = tmp_path / "plan-cache.json"
+    path.write_text("not json")
+
+    cache = PlanCache.load(str(path))
+    _plan(_wallets(), market(), cache)
+    assert cache.misses == 2
+
+
+def test_cache_of_another_version_is_ignored(tmp_path, market):
+    path = tmp_path / "plan-cache.json"
+    path.write_text('{"version": 1, "entries": {}}')
+
+    cache = PlanCache.load(str(path))
+    _plan(_wallets(), market(), cache)
+    assert cache.misses == 2
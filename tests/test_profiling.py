@@ -0,0 +1,70 @@
+import json
+from decimal import Decimal
+
+from bf_duster.cassette import Cassette, ReplayRestClient
+from bf_duster.output import JsonLinesResultWriter
+from bf_duster.profiling import profile_sweep
+from bf_duster.repo import BitfinexRepo
+from bf_duster.steps import process_all
+
+
+def _interaction(method, path, body, params=None, elapsed=0.01):
+    return {"method": method, "path": path, "params": params or {}, "status": 200, "body": json.dumps(body),
+            "elapsed": elapsed}
+
+
+def _sweep_cassette(wallets_elapsed=0.01):
+    wallets = [["exchange", "ETH", 1, 0, 1, None, None]]
+    order = [42, None, 0, "tETHBTC", 1680000000000, 1680000000001, 0, -1, "EXCHANGE MARKET", None, None, None, 0,
+             "EXECUTED @ 0.05(-1.0)", None, None, 0.05, 0.05] + [None] * 14
+    pair_info = [None, None, None, "0.1", "1000"]
+    return Cassette([
+        _interaction("POST", "v2/auth/r/wallets", wallets),
+        _interaction("GET", "v2/tickers", [["tETHBTC", 0, 0, 0, 0, 0, 0, 0.05], ["tBTCUSD", 0, 0, 0, 0, 0, 0, 20000]],
+                     {"symbols": "ALL"}),
+        _interaction("GET", "v2/conf/pub:info:pair", [[["ETHBTC", pair_info], ["BTCUSD", pair_info]]]),
+        _interaction("POST", "v2/auth/r/wallets", wallets, elapsed=wallets_elapsed),
+        _interaction("POST", "v2/auth/w/order/submit", [0, "on-req", None, None, [order], None, "SUCCESS", ""],
+                     {"type": "EXCHANGE MARKET", "symbol": "tethbtc", "amount": "-1.00000000"}),
+        _interaction("POST", "v2/auth/r/orders/hist", [order], {"id": [42]}),
+        _interaction("POST", "v2/auth/r/trades/hist",
+                     [[1, "tETHBTC", 1680000000001, 42, -1, 0.05, "EXCHANGE MARKET", 0.05, -1, -0.0001, "BTC", 0]],
+                     {"start": 1680000000000, "limit": 2500}),
+    ])
+
+
+def test_profile_sweep_writes_phase_and_allocation_reports(tmp_path, capsys):
+    repo = BitfinexRepo(ReplayRestClient(_sweep_cassette()))
+    profile_dir = tmp_path / "profile"
+
+    with profile_sweep(str(profile_dir), trace_allocations=True):
+        process_all(repo, Decimal(10000), JsonLinesResultWriter())
+
+    result = json.loads(capsys.readouterr().out)
+    assert result["order_id"] == 42
+    assert result["fill_price"] == "0.05"
+    assert result["fee"] == "-0.0001"
+
+    phases = json.loads((profile_dir / "phases.json").read_text())
+    assert set(phases["phases"]) == {"network", "confirmation_wait", "decode", "planning", "other"}
+    assert phases["phases"]["network"]["calls"] == 5, "Confirmation requests run on the background thread"
+    assert phases["phases"]["confirmation_wait"]["calls"] == 1
+    assert phases["phases"]["planning"]["calls"] == 3, "The market index plus two resumes of the order generator"
+    assert phases["phases"]["decode"]["calls"] > 0
+    assert "_iter_consolidation_orders" in (profile_dir / "phase-planning.txt").read_text()
+    assert (profile_dir / "sweep.prof").stat().st_size > 0
+    assert (profile_dir / "allocations.txt").read_text().startswith("Peak traced memory")
+
+
+def test_profile_sweep_keeps_wallet_requests_out_of_planning(tmp_path, capsys):
+    repo = BitfinexRepo(ReplayRestClient(_sweep_cassette(wallets_elapsed=0.3), latency_scale=1.0))
+    profile_dir = tmp_path / "profile"
+
+    with profile_sweep(str(profile_dir)):
+        process_all(repo, Decimal(10000), JsonLinesResultWriter())
+    capsys.readouterr()
+
+    phases = json.loads((profile_dir / "phases.json").read_text())["phases"]
+    assert phases["network"]["seconds"] >= 0.3
+    assert phases["planning"]["seconds"] < 0.1, "The wallet request should not be counted as planning"
+    assert not (profile_dir / "allocations.txt").exists(), "Allocations are only traced when asked for"
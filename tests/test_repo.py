@@ -0,0 +1,80 @@
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from bf_duster.repo import BitfinexRepo
+
+
+def _response(data, status_code=200):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = data
+    return resp
+
+
+def _order(order_id, status, avg_price, mts_create=1680000000000):
+    order = [None] * 32
+    order[0] = order_id
+    order[3] = "tETHBTC"
+    order[4] = mts_create
+    order[13] = status
+    order[17] = avg_price
+    return order
+
+
+def _trade(order_id, amount, price, fee, fee_currency="BTC"):
+    return [1, "tETHBTC", 1680000000001, order_id, amount, price, "EXCHANGE MARKET", price, -1, fee, fee_currency, 0]
+
+
+def test_create_order_returns_order_id():
+    client = MagicMock()
+    client.request_securely.return_value = _response(
+        [1680000000000, "on-req", None, None, [_order(42, "ACTIVE", 0)], None, "SUCCESS", "Submitting order"]
+    )
+    repo = BitfinexRepo(client)
+
+    assert repo.create_order("EXCHANGE MARKET", "tethbtc", Decimal("-0.5")) == 42
+    client.request_securely.assert_called_once_with(
+        "v2/auth/w/order/submit", {"type": "EXCHANGE MARKET", "symbol": "tethbtc", "amount": "-0.5"}, None
+    )
+
+
+def test_get_order_fills_batches_status_and_trades():
+    client = MagicMock()
+    client.request_securely.side_effect = [
+        _response([
+            _order(1, "EXECUTED @ 0.0625(-0.5)", 0.0625, mts_create=1680000000100),
+            _order(2, "EXECUTED @ 0.06(-1.0)", None, mts_create=1680000000000),
+            _order(99, "CANCELED", None),
+        ]),
+        _response([
+            _trade(1, -0.5, 0.0625, -0.0000625),
+            _trade(2, -0.4, 0.05, -0.00002),
+            _trade(2, -0.6, 0.1, -0.00006),
+            _trade(7, -1, 1, -0.1),
+        ]),
+    ]
+    repo = BitfinexRepo(client)
+
+    fills = {f.order_id: f for f in repo.get_order_fills([1, 2])}
+
+    assert client.request_securely.call_count == 2, "A whole batch should be confirmed with two requests"
+    assert client.request_securely.call_args_list[1].args[1]["start"] == 1680000000000
+    assert set(fills) == {1, 2}
+    assert fills[1].fill_price == Decimal("0.0625")
+    assert fills[1].fee == Decimal("-0.0000625")
+    assert fills[1].fee_currency == "BTC"
+    assert fills[2].fill_price == Decimal("0.08"), "Fill price should fall back to the trade weighted average"
+    assert fills[2].fee == Decimal("-0.00008")
+
+
+def test_get_order_fills_keeps_the_sign_of_maker_rebates():
+    client = MagicMock()
+    client.request_securely.side_effect = [
+        _response([_order(1, "EXECUTED @ 0.0625(-0.5)", 0.0625)]),
+        _response([_trade(1, -0.2, 0.0625, 0.00001), _trade(1, -0.3, 0.0625, -0.00003)]),
+    ]
+    repo = BitfinexRepo(client)
+
+    [fill] = repo.get_order_fills([1])
+
+    assert fill.fee == Decimal("-0.00002"), "A rebate should offset the fees paid instead of adding to them"
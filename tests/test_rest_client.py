@@ -0,0 +1,50 @@
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+from bf_duster.rest_client import RestClient, next_nonce
+
+
+def _http_response(data, status_code=200):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.text = json.dumps(data)
+    return resp
+
+
+def test_next_nonce_increases_across_threads():
+    nonces = []
+
+    def take():
+        nonces.extend(int(next_nonce()) for _ in range(1000))
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(nonces)) == len(nonces), "No nonce should be handed out twice"
+
+
+def test_request_rejected_for_a_small_nonce_is_signed_again():
+    with patch("bf_duster.rest_client.requests") as mock_requests:
+        mock_requests.post.side_effect = [
+            _http_response(["error", 10114, "nonce: small"], 500), _http_response([["exchange", "ETH", 1, 0, 1]])
+        ]
+        client = RestClient("https://api.bitfinex.com/", "my-api-key", "my-api-secret")
+        resp = client.request_securely("v2/auth/r/wallets")
+
+    assert resp.status_code == 200
+    first, second = (c.kwargs["headers"]["bfx-nonce"] for c in mock_requests.post.call_args_list)
+    assert int(second) > int(first)
+
+
+def test_request_is_not_resent_for_other_errors():
+    with patch("bf_duster.rest_client.requests") as mock_requests:
+        mock_requests.post.return_value = _http_response(["error", 10100, "apikey: invalid"], 500)
+        client = RestClient("https://api.bitfinex.com/", "my-api-key", "my-api-secret")
+        resp = client.request_securely("v2/auth/r/wallets")
+
+    assert resp.status_code == 500
+    assert mock_requests.post.call_count == 1
@@ -0,0 +1,73 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from bf_duster.errors import SettingsException
+from bf_duster.settings import load_settings
+
+# Time --help may take on top of a bare interpreter start. Importing pydantic, requests, steps and repo adds roughly
+# 0.2-0.3s, so a regression exceeds this while the argparse work stays well below it.
+COLD_START_BUDGET_SECONDS = 0.1
+COLD_START_RUNS = 5
+
+
+def _run_python(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+
+def test_main_module_does_not_import_heavy_modules():
+    r = _run_python(
+        "import sys\n"
+        "import bf_duster.__main__\n"
+        "heavy = {'pydantic', 'requests', 'bf_duster.steps', 'bf_duster.market', 'bf_duster.repo'}\n"
+        "print(','.join(sorted(heavy & set(sys.modules))))\n"
+    )
+    assert r.stdout.strip() == "", f"Heavy modules imported at startup: {r.stdout.strip()}"
+
+
+def _fastest_run(args: list[str]) -> tuple[float, subprocess.CompletedProcess]:
+    """
+    Run a command several times and return the fastest wall time, which is the least affected by machine noise.
+    """
+    best, r = None, None
+    for _ in range(COLD_START_RUNS):
+        started = time.perf_counter()
+        r = subprocess.run(args, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, r
+
+
+def test_help_cold_start_is_within_budget():
+    baseline, _ = _fastest_run([sys.executable, "-c", "pass"])
+    elapsed, r = _fastest_run([sys.executable, "-m", "bf_duster", "--help"])
+
+    assert r.returncode == 0
+    assert "--max-value-usd" in r.stdout
+    assert elapsed - baseline < COLD_START_BUDGET_SECONDS, \
+        f"Cold start took {elapsed:.3f}s against a {baseline:.3f}s interpreter baseline"
+
+
+def test_load_settings_reads_env_file_and_environment(tmp_path, monkeypatch):
+    env_file = tmp_path / ".env"
+    env_file.write_text("# credentials\nBF_API_KEY='file-key'\nbf_api_secret=file-secret\n")
+    monkeypatch.delenv("BF_API_KEY", raising=False)
+    monkeypatch.delenv("BF_API_SECRET", raising=False)
+
+    s = load_settings(str(env_file))
+    assert s.api_key == "file-key"
+    assert s.api_secret == "file-secret"
+
+    monkeypatch.setenv("BF_API_KEY", "env-key")
+    s = load_settings(str(env_file))
+    assert s.api_key == "env-key", "Environment variables should take precedence over the env file"
+
+
+def test_load_settings_fails_when_missing(tmp_path, monkeypatch):
+    monkeypatch.delenv("BF_API_KEY", raising=False)
+    monkeypatch.delenv("BF_API_SECRET", raising=False)
+
+    with pytest.raises(SettingsException):
+        load_settings(str(tmp_path / ".env"))
@@ -3,8 +3,13 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
-from bf_duster.models import Wallet, PricedPair
-from bf_duster.steps import _create_sell_transaction, _create_buy_transaction, _create_order_transaction
+from bf_duster.errors import RepoException
+from bf_duster.market import MarketIndex
+from bf_duster.models import Wallet, PricedPair, CreateOrderTransaction, OrderFill
+from bf_duster.steps import (
+    _create_sell_transaction, _create_buy_transaction, _create_order_transaction, _iter_consolidation_orders,
+    _iter_confirmed_transactions, process_all
+)
 
 
 @pytest.fixture
@@ -32,12 +37,20 @@ def test_create_sell_transaction(priced_pair):
     assert t is None, "Should not be able to create a sell order with less than min order size"
 
 
+@pytest.mark.parametrize("balance,expected", [("2.123456789", "-2.12345678"), ("0.00600000999", "-0.006")])
+def test_create_sell_transaction_truncates_to_bitfinex_precision(priced_pair, balance, expected):
+    t = _create_sell_transaction(wallet_currency="BTC", balance_available=Decimal(balance), pair=priced_pair)
+    assert t.amount == Decimal(expected)
+    assert t.amount.as_tuple().exponent == -8
+
+
 def test_create_buy_transaction(priced_pair):
     t = _create_buy_transaction(wallet_currency="USD", balance_available=Decimal(1000), pair=priced_pair)
 
     assert t.type == "EXCHANGE MARKET"
     assert t.trading_symbol == "tbtcusd"
     assert t.amount.compare(Decimal('0.037'))
+    assert t.amount == Decimal('0.03703703'), "Buy amount should be truncated to 8 decimals"
     assert t.success is False
     assert t.message is None
 
@@ -72,3 +85,162 @@ def test_create_order_transaction(priced_pair):
         _create_order_transaction(w, "USD", market_index)
         mock_create_buy.assert_not_called()
         mock_create_sell.assert_called_once()
+
+
+@pytest.fixture
+def market_index(make_pair):
+    return MarketIndex([
+        make_pair("BTCUSD", "20000", "0.0002"),
+        make_pair("ETHBTC", "0.005", "0.5"),
+        make_pair("ETHUSD", "100", "0.01"),
+        make_pair("XRPBTC", "0.00002", "100"),
+        make_pair("XRPUSD", "0.5", "4"),
+        make_pair("LTCBTC", "0.003", "0.1"),
+    ])
+
+
+def _exchange_wallet(currency, balance):
+    return Wallet(type="exchange", currency=currency, balance_available=Decimal(balance))
+
+
+def _plan(wallets, market_index):
+    pooled_currencies = []
+    orders = list(_iter_consolidation_orders(
+        wallets, market_index, Decimal(10), "btc", ["usd", "ust"], pooled_currencies
+    ))
+    return orders, pooled_currencies
+
+
+def test_plan_consolidation_pools_sub_minimum_balances(market_index):
+    wallets = [
+        _exchange_wallet("ETH", "0.02"),
+        _exchange_wallet("XRP", "5"),
+        _exchange_wallet("LTC", "0.15"),
+        _exchange_wallet("BTC", "1"),
+        Wallet(type="margin", currency="ETH", balance_available=Decimal(1)),
+    ]
+
+    orders, pooled_currencies = _plan(wallets, market_index)
+
+    assert [(t.trading_symbol, t.amount) for t in orders] == [
+        ("tltcbtc", Decimal("-0.15")),
+        ("tethusd", Decimal("-0.02")),
+        ("txrpusd", Decimal("-5")),
+    ]
+    assert pooled_currencies == ["usd"], "ETH and XRP only clear the BTCUSD minimum together"
+
+
+def test_plan_consolidation_skips_pools_that_can_not_reach_target(market_index):
+    orders, pooled_currencies = _plan([_exchange_wallet("ETH", "0.02")], market_index)
+
+    assert orders == []
+    assert pooled_currencies == []
+
+
+def test_plan_consolidation_pools_into_existing_balance(market_index):
+    wallets = [_exchange_wallet("ETH", "0.02"), _exchange_wallet("USD", "3")]
+
+    orders, pooled_currencies = _plan(wallets, market_index)
+
+    assert [t.trading_symbol for t in orders] == ["tethusd"]
+    assert pooled_currencies == ["usd"]
+
+
+def test_iter_consolidation_orders_yields_direct_orders_lazily(market_index):
+    pulled = []
+
+    def wallets():
+        for w in [_exchange_wallet("LTC", "0.15"), _exchange_wallet("ETH", "0.02"), _exchange_wallet("XRP", "5")]:
+            pulled.append(w.currency)
+            yield w
+
+    pooled_currencies = []
+    orders = _iter_consolidation_orders(wallets(), market_index, Decimal(10), "btc", ["usd", "ust"], pooled_currencies)
+    assert pulled == [], "No wallet should be pulled before the first order is requested"
+
+    assert next(orders).trading_symbol == "tltcbtc"
+    assert pulled == ["ltc"], "A direct order should not wait for the remaining wallets"
+    assert pooled_currencies == []
+
+    assert [t.trading_symbol for t in orders] == ["tethusd", "txrpusd"]
+    assert pulled == ["ltc", "eth", "xrp"]
+    assert pooled_currencies == ["usd"]
+
+
+def test_process_all_converts_pools_after_dust_orders(market_index):
+    events = []
+
+    def wallets():
+        for w in [_exchange_wallet("LTC", "0.15"), _exchange_wallet("ETH", "0.02"), _exchange_wallet("XRP", "5")]:
+            events.append(f"decode {w.currency}")
+            yield w
+
+    def pooled_wallets():
+        events.append("read pools")
+        yield _exchange_wallet("USD", "4.4")
+
+    repo = MagicMock()
+    repo.iter_wallets.side_effect = [iter([]), wallets(), pooled_wallets()]
+    repo.create_order.side_effect = lambda order_type, symbol, amount: events.append(f"submit {symbol} {amount}")
+
+    with patch("bf_duster.steps.build_market_index", return_value=market_index), \
+            patch("builtins.print"):
+        process_all(repo, Decimal(10))
+
+    assert events == [
+        "decode ltc", "submit tltcbtc -0.15000000",
+        "decode eth", "decode xrp", "submit tethusd -0.02000000", "submit txrpusd -5.00000000",
+        "read pools", "submit tbtcusd 0.00022000",
+    ]
+
+
+def _submitted(order_id, success=True):
+    return CreateOrderTransaction(
+        type="EXCHANGE MARKET", trading_symbol="tethbtc", amount=Decimal(-1), success=success, order_id=order_id
+    )
+
+
+def test_iter_confirmed_transactions_records_fills_in_batches():
+    repo = MagicMock()
+    repo.get_order_fills.side_effect = lambda order_ids: [
+        OrderFill(order_id=i, status="EXECUTED", fill_price=Decimal("0.06"), fee=Decimal("-0.0001"), fee_currency="BTC")
+        for i in order_ids
+    ]
+    failed = _submitted(None, success=False)
+    transactions = [_submitted(1), _submitted(2), failed, _submitted(3)]
+
+    confirmed = list(_iter_confirmed_transactions(repo, transactions, batch_size=2))
+
+    assert len(confirmed) == 4
+    assert [c.args[0] for c in repo.get_order_fills.call_args_list] == [[1, 2], [3]]
+    for t in confirmed:
+        if t is failed:
+            assert t.order_status is None
+        else:
+            assert t.order_status == "EXECUTED"
+            assert t.fill_price == Decimal("0.06")
+            assert t.fee == Decimal("-0.0001")
+
+
+def test_iter_confirmed_transactions_marks_active_orders():
+    repo = MagicMock()
+    repo.get_order_fills.return_value = []
+
+    with patch("bf_duster.steps.time.sleep") as mock_sleep:
+        confirmed = list(_iter_confirmed_transactions(repo, [_submitted(1)]))
+
+    assert confirmed[0].order_status == "ACTIVE"
+    assert confirmed[0].success is True
+    assert mock_sleep.call_count == 2
+
+
+@pytest.mark.parametrize("error", [RepoException("timeout"), IndexError("list index out of range")])
+def test_iter_confirmed_transactions_survives_confirmation_failures(error):
+    repo = MagicMock()
+    repo.get_order_fills.side_effect = error
+
+    confirmed = list(_iter_confirmed_transactions(repo, [_submitted(1), _submitted(2)]))
+
+    assert [t.order_status for t in confirmed] == ["UNCONFIRMED", "UNCONFIRMED"]
+    assert all(t.success for t in confirmed), "The orders were placed even if their fills could not be confirmed"
+    assert confirmed[0].message.startswith("Could not confirm fill")
@@ -0,0 +1,269 @@
+import hashlib
+import hmac
+import json
+import queue
+import threading
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pytest
+
+from bf_duster import repo as repo_module, wallet_stream
+from bf_duster.errors import RepoException
+from bf_duster.repo import BitfinexRepo
+from bf_duster.rest_client import next_nonce
+from bf_duster.wallet_stream import WalletStream
+
+
+class LocalWebSocket:
+    """
+    In-process stand-in for a Bitfinex websocket connection. Messages pushed by the test are returned by recv().
+    """
+
+    def __init__(self, auth_status="OK"):
+        self.sent = []
+        self._incoming = queue.Queue()
+        self._auth_status = auth_status
+        self._timeout = 5
+
+    def push(self, message):
+        self._incoming.put(json.dumps(message))
+
+    def send(self, data):
+        message = json.loads(data)
+        self.sent.append(message)
+        if isinstance(message, dict) and message.get("event") == "auth" and self._auth_status is not None:
+            self.push({"event": "auth", "status": self._auth_status, "chanId": 0, "msg": "apikey: invalid"})
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def recv(self):
+        try:
+            data = self._incoming.get(timeout=self._timeout)
+        except queue.Empty:
+            raise TimeoutError("timed out") from None
+        if data is None:
+            raise ConnectionError("closed")
+        return data
+
+    def close(self):
+        self._incoming.put(None)
+
+
+def _start(ws, snapshot):
+    ws.push({"event": "info", "version": 2})
+    stream = WalletStream("my-api-key", "my-api-secret", create_connection=lambda url, timeout: ws)
+    threading.Timer(0.01, ws.push, args=([0, "ws", snapshot],)).start()
+    stream.start(timeout=5)
+    return stream
+
+
+def test_stream_authenticates_and_applies_snapshot_and_updates():
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1.5, 0, None], ["margin", "USD", 10, 0, 8]])
+    try:
+        auth = ws.sent[0]
+        assert auth["event"] == "auth"
+        assert auth["filter"] == ["wallet", "trading"]
+        expected_sig = hmac.new(b"my-api-secret", auth["authPayload"].encode(), hashlib.sha384).hexdigest()
+        assert auth["authSig"] == expected_sig
+        assert auth["authPayload"] == "AUTH" + auth["authNonce"]
+        assert 0 < int(next_nonce()) - int(auth["authNonce"]) < 10000, "The nonce should come from the REST sequence"
+
+        wallets = {(w.type, w.currency): w.balance_available for w in stream.store.wallets()}
+        assert wallets == {("margin", "usd"): Decimal(8)}, "Wallets without an available balance wait for calc"
+        assert ws.sent[1] == [0, "calc", None, [["wallet_exchange_ETH"]]]
+
+        ws.push([0, "wu", ["exchange", "ETH", 1.5, 0, 1.2, None, None]])
+        assert stream.store.wait_for_sync({}, {}, timeout=5)
+        wallets = {(w.type, w.currency): w.balance_available for w in stream.store.wallets()}
+        assert wallets == {("exchange", "eth"): Decimal("1.2"), ("margin", "usd"): Decimal(8)}
+
+        counts = stream.store.update_counts([("exchange", "eth")])
+        ws.push([0, "hb"])
+        ws.push([0, "wu", ["exchange", "ETH", 0.5, 0, 0.5, "Exchange 1.0 ETH for BTC", None]])
+        assert stream.store.wait_for_sync(counts, {}, timeout=5)
+        wallets = {(w.type, w.currency): w.balance_available for w in stream.store.wallets()}
+        assert wallets[("exchange", "eth")] == Decimal("0.5")
+    finally:
+        stream.close()
+
+
+def test_stream_fails_when_authentication_fails():
+    ws = LocalWebSocket(auth_status="FAILED")
+    stream = WalletStream("my-api-key", "my-api-secret", create_connection=lambda url, timeout: ws)
+
+    with pytest.raises(RepoException, match="apikey: invalid"):
+        stream.start(timeout=1)
+
+
+def test_stream_start_times_out_without_an_auth_reply():
+    ws = LocalWebSocket(auth_status=None)
+    ws.push({"event": "info", "version": 2})
+    stream = WalletStream("my-api-key", "my-api-secret", create_connection=lambda url, timeout: ws)
+
+    with pytest.raises(RepoException, match="Could not start the wallet stream: TimeoutError"):
+        stream.start(timeout=0.05)
+
+
+def test_stream_start_reports_unreadable_messages():
+    ws = LocalWebSocket()
+    ws._incoming.put("not json")
+    stream = WalletStream("my-api-key", "my-api-secret", create_connection=lambda url, timeout: ws)
+
+    with pytest.raises(RepoException, match="Could not start the wallet stream: JSONDecodeError"):
+        stream.start(timeout=1)
+
+
+def test_stream_start_reports_connection_errors():
+    def refuse(url, timeout):
+        raise ConnectionRefusedError("refused")
+
+    with pytest.raises(RepoException, match="ConnectionRefusedError"):
+        WalletStream("my-api-key", "my-api-secret", create_connection=refuse).start(timeout=1)
+
+
+def _order(order_id, status):
+    return [order_id, None, 0, "tETHBTC", 1680000000000, 1680000000001, 0, -1, "EXCHANGE MARKET", None, None, None, 0,
+            status, None, None, 0.05, 0.05] + [None] * 14
+
+
+def _client(wallets=None):
+    def request_securely(path, params=None, headers=None):
+        response = MagicMock(status_code=200)
+        if path == "v2/auth/w/order/submit":
+            response.json.return_value = [0, "on-req", None, None, [[42]], None, "SUCCESS", ""]
+        elif path == "v2/auth/r/wallets":
+            response.json.return_value = wallets
+        else:
+            response.json.return_value = []
+        return response
+
+    client = MagicMock()
+    client.request_securely.side_effect = request_securely
+    return client
+
+
+def _requested_paths(client):
+    return [c.args[0] for c in client.request_securely.call_args_list]
+
+
+def test_repo_reads_wallets_from_stream_after_its_own_writes():
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1, 0, 1]])
+    client = _client()
+    repo = BitfinexRepo(client, stream.store)
+    try:
+        assert [w.currency for w in repo.iter_wallets()] == ["eth"]
+
+        assert repo.create_order("EXCHANGE MARKET", "tethbtc", Decimal(-1)) == 42
+
+        def fill():
+            # two partial fills update the ETH wallet twice, the BTC wallet is new and the order closes last
+            ws.push([0, "wu", ["exchange", "ETH", 0.5, 0, 0.5]])
+            ws.push([0, "wu", ["exchange", "ETH", 0, 0, 0]])
+            ws.push([0, "wu", ["exchange", "BTC", 0.05, 0, 0.05]])
+            ws.push([0, "oc", _order(42, "EXECUTED @ 0.05(-1.0)")])
+
+        threading.Timer(0.05, fill).start()
+        wallets = {w.currency: w.balance_available for w in repo.get_wallets()}
+        assert wallets == {"eth": Decimal(0), "btc": Decimal("0.05")}, "Reads should wait for the order's updates"
+        assert len(ws.sent) == 1, "Calculated balances should not be requested again"
+        assert _requested_paths(client) == ["v2/auth/w/order/submit"], "Wallets should not be requested over REST"
+    finally:
+        stream.close()
+
+
+def test_repo_does_not_wait_for_wallet_updates_of_unfilled_orders():
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1, 0, 1]])
+    repo = BitfinexRepo(_client(), stream.store)
+    try:
+        repo.create_order("EXCHANGE MARKET", "tethbtc", Decimal(-1))
+        ws.push([0, "oc", _order(42, "CANCELED")])
+
+        wallets = {w.currency: w.balance_available for w in repo.get_wallets()}
+        assert wallets == {"eth": Decimal(1)}
+    finally:
+        stream.close()
+
+
+def test_repo_waits_for_both_wallets_of_a_transfer():
+    ws = LocalWebSocket()
+    stream = _start(ws, [["margin", "ETH", 1, 0, 1]])
+    client = _client()
+    repo = BitfinexRepo(client, stream.store)
+    try:
+        repo.transfer("margin", "exchange", "ETH", "ETH", Decimal(1))
+        ws.push([0, "wu", ["margin", "ETH", 0, 0, 0]])
+        threading.Timer(0.05, ws.push, args=([0, "wu", ["exchange", "ETH", 1, 0, 1]],)).start()
+
+        wallets = {(w.type, w.currency): w.balance_available for w in repo.get_wallets()}
+        assert wallets == {("margin", "eth"): Decimal(0), ("exchange", "eth"): Decimal(1)}
+        assert _requested_paths(client) == ["v2/auth/w/transfer"]
+    finally:
+        stream.close()
+
+
+def test_repo_falls_back_to_rest_when_the_stream_stops():
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1, 0, 1]])
+    client = _client(wallets=[["exchange", "ETH", 2, 0, 2, None, None]])
+    repo = BitfinexRepo(client, stream.store)
+
+    ws.close()
+    stream._thread.join(timeout=5)
+    assert not stream.store.connected
+    assert [w.balance_available for w in repo.get_wallets()] == [Decimal(2)]
+    assert [w.balance_available for w in repo.iter_wallets()] == [Decimal(2)]
+    assert _requested_paths(client) == ["v2/auth/r/wallets", "v2/auth/r/wallets"]
+    stream.close()
+
+
+def test_stream_disconnects_the_store_when_heartbeats_stop(monkeypatch):
+    monkeypatch.setattr(wallet_stream, "_IDLE_TIMEOUT_SECONDS", 0.05)
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1, 0, 1]])
+
+    stream._thread.join(timeout=5)
+    assert not stream.store.connected
+    stream.close()
+
+
+def test_repo_waits_for_calculated_balances_after_an_order():
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1, 0, 1]])
+    client = _client()
+    repo = BitfinexRepo(client, stream.store)
+    try:
+        repo.create_order("EXCHANGE MARKET", "tethbtc", Decimal(-1))
+        # trades update the wallets without an available balance, which only the calc reply carries
+        ws.push([0, "wu", ["exchange", "ETH", 0, 0, None]])
+        ws.push([0, "wu", ["exchange", "BTC", 0.05, 0, None]])
+        ws.push([0, "oc", _order(42, "EXECUTED @ 0.05(-1.0)")])
+
+        def calculated():
+            ws.push([0, "wu", ["exchange", "ETH", 0, 0, 0]])
+            ws.push([0, "wu", ["exchange", "BTC", 0.05, 0, 0.049]])
+
+        threading.Timer(0.05, calculated).start()
+        wallets = {w.currency: w.balance_available for w in repo.get_wallets()}
+        assert wallets == {"eth": Decimal(0), "btc": Decimal("0.049")}
+        assert [m[1] for m in ws.sent[1:]] == ["calc", "calc"]
+        assert _requested_paths(client) == ["v2/auth/w/order/submit"]
+    finally:
+        stream.close()
+
+
+def test_repo_falls_back_to_rest_while_balances_are_not_calculated(monkeypatch):
+    monkeypatch.setattr(repo_module, "_WALLET_SYNC_TIMEOUT_SECONDS", 0.05)
+    ws = LocalWebSocket()
+    stream = _start(ws, [["exchange", "ETH", 1, 0, None]])
+    client = _client(wallets=[["exchange", "ETH", 1, 0, 0.8, None, None]])
+    repo = BitfinexRepo(client, stream.store)
+    try:
+        assert [w.balance_available for w in repo.get_wallets()] == [Decimal("0.8")]
+        assert _requested_paths(client) == ["v2/auth/r/wallets"]
+    finally:
+        stream.close()